@@ -27,6 +27,13 @@ DB_PATH = os.path.join(PROJECT_ROOT, "database", "kairos.db")
 UPLOADS_DIR = os.path.join(PROJECT_ROOT, "uploads")
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
+# ETL: importarlo no tiene efectos (las rutas se resuelven en cada corrida)
+import sys
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from etl.etl_pipeline import main as run_etl, compactar_tipos
+
 
 MESES = {
     1: "Enero", 2: "Febrero", 3: "Marzo", 4: "Abril",
@@ -210,23 +217,141 @@ div.stButton > button:hover {
 </style>
 """, unsafe_allow_html=True)
 # ======================================================
-# DATA (PostgreSQL - Neon)
+# DATA (PostgreSQL - Neon, o réplica SQLite local)
 # ======================================================
-
-from sqlalchemy import create_engine
+# KAIROS_BACKEND elige de dónde lee el dashboard:
+#   postgres       -> siempre DATABASE_URL (por defecto)
+#   local-replica  -> solo database/kairos.db (la arma etl/sync_postgres_to_sqlite.py)
+#   replica-first  -> lee la réplica al instante y, en segundo plano, revisa si
+#                     Postgres tiene una corrida ETL más nueva; si la hay sincroniza
+#                     y limpia la cache (la próxima recarga ya ve los datos nuevos)
+
+from sqlalchemy import create_engine, text
 import os
+import time
+import threading
+
+from etl.sync_postgres_to_sqlite import main as sync_replica
+
+BACKENDS = ("postgres", "local-replica", "replica-first")
+BACKEND = os.environ.get("KAIROS_BACKEND", "postgres").strip().lower()
+REVALIDAR_CADA_SEG = int(os.environ.get("KAIROS_REVALIDAR_SEG", "300"))
 
 # 🔐 Obtener variable de entorno UNA sola vez
 
 DATABASE_URL = os.environ.get("DATABASE_URL")# falla inmediato si no existe
+REPLICA_URL = f"sqlite:///{DB_PATH}"
+
+if BACKEND not in BACKENDS:
+    st.error(f"KAIROS_BACKEND inválido: {BACKEND} (opciones: {', '.join(BACKENDS)})")
+    st.stop()
 
-if not DATABASE_URL:
+# con la réplica local sola se puede leer sin Postgres
+if not DATABASE_URL and BACKEND != "local-replica":
     st.error("DATABASE_URL no configurada.")
     st.stop()
 
+
+def replica_lista() -> bool:
+    """La réplica existe y ya trae las tablas del dashboard."""
+    if not os.path.exists(DB_PATH):
+        return False
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'fact_ventas'"
+        ).fetchone() is not None
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+
+def version_etl(url: str):
+    """run_id de la última corrida ETL registrada en la base (None si no hay)."""
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                text("SELECT run_id FROM etl_runs ORDER BY inicio DESC LIMIT 1")
+            ).scalar()
+    except Exception:
+        return None
+    finally:
+        engine.dispose()
+
+
+@st.cache_resource
+def estado_replica() -> dict:
+    """Estado de la revalidación, compartido entre sesiones del servidor."""
+    return {"lock": threading.Lock(), "hilo": None, "revisado": 0.0, "error": None}
+
+
+def _revalidar(estado: dict):
+    try:
+        remota = version_etl(DATABASE_URL)
+        # sin etl_runs no hay con qué comparar: el sync (incremental) decide
+        if remota is None or remota != version_etl(REPLICA_URL):
+            sync_replica(DATABASE_URL, DB_PATH)
+            st.cache_data.clear()
+        estado["error"] = None
+    except Exception as e:
+        estado["error"] = str(e)
+        print(f"⚠️ No se pudo revalidar la réplica: {e}")
+
+
+def revalidar_replica(forzar: bool = False, esperar: bool = False):
+    """
+    Lanza el chequeo contra Postgres en un hilo (uno a la vez, cada
+    REVALIDAR_CADA_SEG). Con `esperar` espera al hilo en curso (pudo leer la
+    versión antes del último ETL), corre uno nuevo y espera que termine:
+    nunca hay dos sync escribiendo la misma réplica.
+    """
+    estado = estado_replica()
+
+    while True:
+        with estado["lock"]:
+            hilo = estado["hilo"]
+            if hilo is None or not hilo.is_alive():
+                if not forzar and time.time() - estado["revisado"] < REVALIDAR_CADA_SEG:
+                    return
+
+                estado["revisado"] = time.time()
+                hilo = threading.Thread(target=_revalidar, args=(estado,), daemon=True)
+                estado["hilo"] = hilo
+                hilo.start()
+                break
+
+            if not esperar:
+                return
+
+        hilo.join()
+
+    if esperar:
+        hilo.join()
+
+
+def url_lectura() -> str:
+    """Base desde la que se leen los datos en esta recarga, según KAIROS_BACKEND."""
+    if BACKEND == "postgres":
+        return str(DATABASE_URL)
+
+    if BACKEND == "local-replica":
+        return REPLICA_URL
+
+    if replica_lista():
+        revalidar_replica()
+        return REPLICA_URL
+
+    # todavía sin réplica: esta vez se lee Postgres y la réplica se arma de fondo
+    revalidar_replica(forzar=True)
+    return str(DATABASE_URL)
+
+
 @st.cache_data
-def load_data():
-    engine = create_engine(str(DATABASE_URL))
+def load_data(url: str):
+    engine = create_engine(url)
 
     ventas = pd.read_sql("SELECT * FROM fact_ventas", engine)
     gastos = pd.read_sql("SELECT * FROM fact_gastos", engine)
@@ -243,18 +368,87 @@ def load_data():
     except Exception:
         calendario = pd.DataFrame()
 
+    # mismos tipos compactos que usa el ETL (category, montos int64)
+    for df in (ventas, gastos, items, secciones, calendario, costos_unitarios):
+        compactar_tipos(df)
+
     return ventas, gastos, items, secciones, calendario, costos_unitarios
 
 
+def agregar_por_mes(df: pd.DataFrame, claves: list[str], col: str = "total") -> pd.DataFrame:
+    """Mismo formato que los agg_* del ETL, calculado en memoria (base sin agg_*)."""
+    df = df.dropna(subset=["fecha"])
+    out = (
+        df.groupby([df["fecha"].dt.to_period("M").rename("periodo")] + claves, dropna=False, observed=True)[col]
+        .sum()
+        .reset_index()
+    )
+    return out.rename(columns={col: "total"})
+
+
+@st.cache_data
+def load_agregados(url: str, _ventas: pd.DataFrame, _gastos: pd.DataFrame, _items: pd.DataFrame):
+    """agg_ventas_mes, agg_gastos_mes_clasificacion y agg_items_mes_seccion, con columna periodo (Period M)."""
+    engine = create_engine(url)
+
+    try:
+        agg_ventas = pd.read_sql("SELECT * FROM agg_ventas_mes", engine)
+        agg_gastos = pd.read_sql("SELECT * FROM agg_gastos_mes_clasificacion", engine)
+        agg_items = pd.read_sql("SELECT * FROM agg_items_mes_seccion", engine)
+    except Exception:
+        # base generada antes de los agregados
+        return (
+            agregar_por_mes(_ventas, []),
+            agregar_por_mes(_gastos, ["clasificacion"]),
+            agregar_por_mes(_items, ["seccion"], col="precio"),
+        )
+
+    for df in (agg_ventas, agg_gastos, agg_items):
+        df["periodo"] = pd.to_datetime(df["mes"]).dt.to_period("M")
+
+    return agg_ventas, agg_gastos, agg_items
+
+
+@st.cache_data(ttl=300)
+def load_ultima_corrida(url: str):
+    """Última corrida del ETL (etl_runs) y el tiempo de su etapa dominante."""
+    engine = create_engine(url)
+
+    try:
+        corrida = pd.read_sql(
+            "SELECT * FROM etl_runs ORDER BY inicio DESC LIMIT 1", engine
+        )
+        if corrida.empty:
+            return None
+
+        corrida = corrida.iloc[0].to_dict()
+        etapas = pd.read_sql(
+            text("SELECT etapa, segundos FROM etl_stage_metrics WHERE run_id = :run_id"),
+            engine,
+            params={"run_id": corrida["run_id"]}
+        )
+        dominante = etapas[etapas["etapa"] == corrida["etapa_dominante"]]
+        corrida["segundos_dominante"] = float(dominante["segundos"].iloc[0]) if not dominante.empty else None
+        return corrida
+
+    except Exception:
+        return None
+
+
 # Intentar cargar datos
+URL_LECTURA = url_lectura()
+
 try:
-    ventas, gastos, items, secciones, calendario, costos_unitarios = load_data()
+    ventas, gastos, items, secciones, calendario, costos_unitarios = load_data(URL_LECTURA)
 
     # convertir fechas
     for df, col in [(ventas, "fecha"), (gastos, "fecha"), (items, "fecha")]:
         if col in df.columns:
             df[col] = pd.to_datetime(df[col], errors="coerce")
 
+    # totales mensuales (históricos, sin filtro) precalculados por el ETL
+    agg_ventas, agg_gastos, agg_items = load_agregados(URL_LECTURA, ventas, gastos, items)
+
 except Exception:
     st.info("📂 Base aún no inicializada.")
     st.divider()
@@ -591,25 +785,49 @@ if st.sidebar.button("🔄 Procesar y Recargar", use_container_width=True):
             # Ejecutar ETL
             # ======================================================
 
-            import sys
-            import os
-
-            PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
-            sys.path.append(PROJECT_ROOT)
-
-            from etl.etl_pipeline import main as run_etl
-
-            run_etl(
+            resultado = run_etl(
                 run_gastos=gastos_file is not None,
                 run_ventas=ventas_file is not None,
                 run_costos=costo_file is not None
-            )
+            ) or {}
 
-            st.cache_data.clear()
+            if resultado.get("omitidas") and not resultado.get("ejecutadas"):
+                # mismos archivos que la última carga: no hay nada que recargar
+                st.sidebar.info("Archivos sin cambios, no fue necesario reprocesar.")
 
-            st.success("Datos actualizados correctamente.")
+            else:
+                # el ETL escribe en Postgres: la réplica se pone al día (por el mismo hilo que la revalidación) antes de recargar
+                if BACKEND != "postgres":
+                    revalidar_replica(forzar=True, esperar=True)
 
-            st.rerun()
+                st.cache_data.clear()
+
+                st.success("Datos actualizados correctamente.")
+
+                st.rerun()
+
+ultima_corrida = load_ultima_corrida(URL_LECTURA)
+
+if ultima_corrida:
+    texto_corrida = (
+        f"Última actualización: {pd.Timestamp(ultima_corrida['fin']):%d/%m %H:%M} · "
+        f"{float(ultima_corrida['segundos']):.1f}s"
+    )
+    if ultima_corrida.get("segundos_dominante") is not None:
+        texto_corrida += (
+            f" · etapa más lenta: {ultima_corrida['etapa_dominante']} "
+            f"({ultima_corrida['segundos_dominante']:.1f}s)"
+        )
+    st.sidebar.caption(texto_corrida)
+
+if URL_LECTURA == REPLICA_URL:
+    estado = estado_replica()
+    texto_replica = "Leyendo réplica local"
+    if estado["hilo"] is not None and estado["hilo"].is_alive():
+        texto_replica += " · revisando Postgres…"
+    elif estado["error"]:
+        texto_replica += f" · ⚠️ sin sincronizar: {estado['error']}"
+    st.sidebar.caption(texto_replica)
 
 # ======================================================
 # CALENDARIO REAL (sin inventar meses)
@@ -727,11 +945,17 @@ if years_sel and months_sel:
             (items_f["fecha"].dt.year.isin(years_sel)) &
             (items_f["fecha"].dt.month.isin(months_sel))
         ]
+    # ventas por sección (mes x sección, precalculado por el ETL)
+    agg_items_f = agg_items[
+        (agg_items["periodo"].dt.year.isin(years_sel)) &
+        (agg_items["periodo"].dt.month.isin(months_sel))
+    ]
 else:
     # si limpiaste todo -> vacío (honesto)
     ventas_f = ventas_f.iloc[0:0]
     gastos_f = gastos_f.iloc[0:0]
     items_f = items_f.iloc[0:0]
+    agg_items_f = agg_items.iloc[0:0]
 
 # ======================================================
 # KPIs Operativos
@@ -1014,27 +1238,16 @@ st.caption(
 # ======================================================
 
 # Solo operación real (desde inicio operación)
-flujo_df = gastos[
-    gastos["clasificacion"].isin(["OPEX_VARIABLE", "OPEX_FIJO"])
-].copy()
-
-ventas_df = ventas.copy()
+flujo_agg = agg_gastos[
+    agg_gastos["clasificacion"].isin(["OPEX_VARIABLE", "OPEX_FIJO"])
+]
 
-# Agrupar por mes
-ventas_m = (
-    ventas_df.groupby([ventas_df["fecha"].dt.to_period("M")])["total"]
-    .sum()
-    .reset_index()
-)
+# Agrupar por mes (agregados del ETL)
+ventas_m = agg_ventas.groupby("periodo")["total"].sum().reset_index()
+costos_m = flujo_agg.groupby("periodo")["total"].sum().reset_index()
 
-costos_m = (
-    flujo_df.groupby([flujo_df["fecha"].dt.to_period("M")])["total"]
-    .sum()
-    .reset_index()
-)
-
-ventas_m.rename(columns={"fecha": "periodo", "total": "ventas"}, inplace=True)
-costos_m.rename(columns={"fecha": "periodo", "total": "costos"}, inplace=True)
+ventas_m.rename(columns={"total": "ventas"}, inplace=True)
+costos_m.rename(columns={"total": "costos"}, inplace=True)
 
 flujo_m = pd.merge(ventas_m, costos_m, on="periodo", how="left")
 flujo_m["costos"] = flujo_m["costos"].fillna(0)
@@ -1063,25 +1276,12 @@ col_graf1, col_graf2 = st.columns(2)
 with col_graf1:
     st.subheader("Resultado Mensual (Histórico)")
 
-    if "fecha" in ventas.columns and "total" in ventas.columns:
-        ventas_mensual = ventas.groupby(
-            ventas["fecha"].dt.to_period("M")
-        )["total"].sum()
-    else:
-        ventas_mensual = pd.Series(dtype=float)
+    ventas_mensual = agg_ventas.groupby("periodo")["total"].sum()
 
-    if "fecha" in gastos.columns and "total" in gastos.columns:
-        if "clasificacion" in gastos.columns:
-            gastos_base = gastos[
-                ~gastos["clasificacion"].isin(["CAPEX", "PRE_OPERACION"])
+    gastos_base = agg_gastos[
+        ~agg_gastos["clasificacion"].isin(["CAPEX", "PRE_OPERACION"])
     ]
-        else:
-            gastos_base = gastos
-        gastos_mensual = gastos_base.groupby(
-            gastos_base["fecha"].dt.to_period("M")
-        )["total"].sum()
-    else:
-        gastos_mensual = pd.Series(dtype=float)
+    gastos_mensual = gastos_base.groupby("periodo")["total"].sum()
 
     resultado_hist = (
         pd.DataFrame(
@@ -1126,31 +1326,27 @@ with col_graf1:
 with col_graf2:
     st.subheader("Top 5 Secciones (Filtro)")
 
-    if items_f.empty or "seccion" not in items_f.columns:
+    if agg_items_f.empty:
         st.info("No hay datos para el filtro actual.")
     else:
-        col_val = "precio" if "precio" in items_f.columns else ("total" if "total" in items_f.columns else None)
-        if col_val is None:
-            st.warning("No encuentro columna de valor (precio/total) en fact_items.")
+        top5 = (
+            agg_items_f.groupby("seccion", observed=True)["total"]
+            .sum()
+            .sort_values(ascending=False)
+            .head(5)
+        )
+
+        if top5.empty:
+            st.info("No hay datos para el filtro actual.")
         else:
-            top5 = (
-                items_f.groupby("seccion")[col_val]
-                .sum()
-                .sort_values(ascending=False)
-                .head(5)
+            fig_donut = px.pie(
+                names=top5.index.astype(str),
+                values=top5.values,
+                hole=0.6,
+                color_discrete_sequence=[KAIROS_CAFE, KAIROS_GOLD, KAIROS_MUTED, "#A67C52", "#6F4E37"]
             )
-
-            if top5.empty:
-                st.info("No hay datos para el filtro actual.")
-            else:
-                fig_donut = px.pie(
-                    names=top5.index.astype(str),
-                    values=top5.values,
-                    hole=0.6,
-                    color_discrete_sequence=[KAIROS_CAFE, KAIROS_GOLD, KAIROS_MUTED, "#A67C52", "#6F4E37"]
-                )
-                fig_donut.update_layout(plot_bgcolor=KAIROS_BG, paper_bgcolor=KAIROS_BG, legend_title_text="")
-                st.plotly_chart(fig_donut, use_container_width=True)
+            fig_donut.update_layout(plot_bgcolor=KAIROS_BG, paper_bgcolor=KAIROS_BG, legend_title_text="")
+            st.plotly_chart(fig_donut, use_container_width=True)
 
 # ======================================================
 # EXPLORADOR: VENTAS / COSTOS (por grupos) - FILTRADO
@@ -1181,6 +1377,17 @@ with tab_v:
 
         dfv = dfv.loc[:, ~dfv.columns.duplicated()]
 
+        # el gráfico sale de agg_items_mes_seccion; la tabla de detalle sigue fila a fila
+        dfa = agg_items_f
+        if not secciones.empty and "seccion" in secciones.columns:
+            dfa = dfa.merge(
+                secciones[[c for c in ["seccion", "grupo_1", "grupo_2"] if c in secciones.columns]]
+                .drop_duplicates("seccion"),
+                on="seccion",
+                how="left",
+                suffixes=("", "_sec")
+            )
+
         val_col = "precio" if "precio" in dfv.columns else ("total" if "total" in dfv.columns else None)
 
         if val_col is None:
@@ -1188,15 +1395,16 @@ with tab_v:
         else:
             group_choice = st.radio(
                 "Agrupar ventas por",
-                options=[c for c in ["grupo_1", "grupo_2", "seccion"] if c in dfv.columns],
+                options=[c for c in ["grupo_1", "grupo_2", "seccion"] if c in dfv.columns and c in dfa.columns],
                 horizontal=True
             )
 
             ventas_grp = (
-                dfv.groupby(group_choice)[val_col]
+                dfa.groupby(group_choice, observed=True)["total"]
                 .sum()
                 .sort_values(ascending=False)
                 .head(15)
+                .rename(val_col)
                 .reset_index()
             )
 
@@ -1317,7 +1525,7 @@ with tab_c:
                     df_oper = df_oper[df_oper["clasificacion"] == "OPEX_FIJO"]
 
             costos_grp = (
-                df_oper.groupby(group_col)["total"]
+                df_oper.groupby(group_col, observed=True)["total"]
                 .sum()
                 .sort_values(ascending=False)
                 .head(15)
@@ -1616,15 +1824,21 @@ st.divider()
 st.subheader("Estado de Resultados Histórico (Mensual)")
 
 # periodos presentes (ordenados)
-periodos = sorted(pd.concat([ventas["fecha"], gastos["fecha"]]).dropna().dt.to_period("M").unique())
+# totales por periodo (agregados del ETL)
+ventas_por_periodo = agg_ventas.groupby("periodo")["total"].sum()
+gastos_por_periodo = (
+    agg_gastos.groupby(["periodo", "clasificacion"])["total"].sum()
+    .unstack(fill_value=0)
+)
+
+periodos = sorted(set(ventas_por_periodo.index) | set(gastos_por_periodo.index))
 
-def sum_by_period(df: pd.DataFrame, period, mask=None, col="total"):
-    if df.empty:
-        return 0.0
-    tmp = df[df["fecha"].dt.to_period("M") == period]
-    if mask is not None:
-        tmp = tmp[mask(tmp)]
-    return float(tmp[col].sum()) if col in tmp.columns else 0.0
+def sum_by_period(tabla, period, col=None) -> float:
+    if col is not None:
+        if col not in tabla.columns:
+            return 0.0
+        tabla = tabla[col]
+    return float(tabla.get(period, 0.0))
 
 rows = {
     "Inversión (Implementación)": [],
@@ -1638,16 +1852,11 @@ rows = {
 }
 
 for p in periodos:
-    v = sum_by_period(ventas, p, col="total")
+    v = sum_by_period(ventas_por_periodo, p)
 
-    if "clasificacion" in gastos.columns:
-        inv = sum_by_period(gastos, p, mask=lambda d: d["clasificacion"] == "CAPEX", col="total")
-        cv = sum_by_period(gastos, p, mask=lambda d: d["clasificacion"] == "OPEX_VARIABLE", col="total")
-        cf = sum_by_period(gastos, p, mask=lambda d: d["clasificacion"] == "OPEX_FIJO", col="total")
-    else:
-        inv = 0.0
-        cv = sum_by_period(gastos, p, col="total")
-        cf = 0.0
+    inv = sum_by_period(gastos_por_periodo, p, col="CAPEX")
+    cv = sum_by_period(gastos_por_periodo, p, col="OPEX_VARIABLE")
+    cf = sum_by_period(gastos_por_periodo, p, col="OPEX_FIJO")
 
     e = v - cv - cf
     eda = e
@@ -1802,7 +2011,7 @@ if not items_f.empty and not costos_unitarios.empty:
 
     # Agrupar por categoría
     margen_cat = (
-        dfm.groupby("grupo_1")[["ventas", "costo_real"]]
+        dfm.groupby("grupo_1", observed=True)[["ventas", "costo_real"]]
         .sum()
         .reset_index()
     )
@@ -1959,7 +2168,7 @@ div.stButton > button[kind="secondary"] {
 # ------------------------------------------------------
 
 precios_productos = (
-    items.groupby(["item", "seccion"])["precio"]
+    items.groupby(["item", "seccion"], observed=True)["precio"]
     .max()
     .reset_index()
     .rename(columns={"precio": "precio_max"})
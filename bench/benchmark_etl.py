@@ -0,0 +1,197 @@
+"""
+Benchmark del ETL con archivos sintéticos (ver generar_datos.py).
+
+Para cada escala genera los archivos, mide cada procesar_* por separado y
+luego main() completo contra un SQLite local (o la URL que se pase), en
+frío y de nuevo con cache / carga incremental. El resultado queda en JSON
+para comparar entre commits.
+
+    python bench/benchmark_etl.py --escalas 1 10
+    python bench/benchmark_etl.py --escalas 1 --database-url postgresql://...
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+
+import pandas as pd
+
+from generar_datos import generar
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+RESULTADOS_DIR = os.path.join(BENCH_DIR, "resultados")
+
+
+def commit_actual():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def medir(funcion, repeticiones=1):
+    """Mejor tiempo (segundos) de `repeticiones` llamadas a funcion()."""
+    mejor = None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion()
+        dt = time.perf_counter() - t0
+        mejor = dt if mejor is None else min(mejor, dt)
+    return round(mejor, 4)
+
+
+def limpiar_estado(etl, uploads_dir, sqlite_path):
+    """Borra cache, manifiesto y base local para que main() parta en frío."""
+    shutil.rmtree(etl.CACHE_DIR, ignore_errors=True)
+    if os.path.exists(etl.RUTA_MANIFIESTO):
+        os.remove(etl.RUTA_MANIFIESTO)
+    if sqlite_path and os.path.exists(sqlite_path):
+        os.remove(sqlite_path)
+
+
+def medir_funciones(etl, rutas, repeticiones):
+    """Tiempo de cada procesar_* por separado; las hojas leídas se liberan al salir."""
+    funciones = {}
+
+    funciones["procesar_gastos"] = medir(lambda: etl.procesar_gastos(rutas["gastos"]), repeticiones)
+    funciones["leer_libro_ventas"] = medir(lambda: etl.leer_libro_ventas(rutas["ventas"]), repeticiones)
+
+    hojas = etl.leer_libro_ventas(rutas["ventas"])
+    funciones["procesar_transacciones"] = medir(
+        lambda: etl.procesar_transacciones(hojas["Transacciones"].copy()), repeticiones
+    )
+    funciones["procesar_items"] = medir(
+        lambda: etl.procesar_items(hojas["Items"].copy()), repeticiones
+    )
+    funciones["procesar_secciones"] = medir(
+        lambda: etl.procesar_secciones(hojas["Secciones"].copy()), repeticiones
+    )
+    funciones["procesar_costo_unitario"] = medir(
+        lambda: etl.procesar_costo_unitario(rutas["costos"]), repeticiones
+    )
+
+    return funciones
+
+
+def correr_escala(etl, escala, uploads_dir, sqlite_path, formato_gastos, repeticiones):
+    print(f"\n=== Escala {escala}x ===")
+
+    t0 = time.perf_counter()
+    rutas = generar(escala, uploads_dir, formato_gastos)
+    print(f"Archivos generados en {time.perf_counter() - t0:.1f}s: {rutas['filas']}")
+
+    # -------------------------
+    # Funciones por separado
+    # -------------------------
+    funciones = medir_funciones(etl, rutas, repeticiones)
+
+    # -------------------------
+    # main() completo
+    # -------------------------
+    corridas = {}
+
+    limpiar_estado(etl, uploads_dir, sqlite_path)
+    resultado = etl.main(forzar=True, incremental=False)
+    corridas["main_frio"] = resultado["metricas"]
+
+    # mismos archivos: cache parquet + ventana incremental
+    resultado = etl.main(forzar=True, incremental=True)
+    corridas["main_cache_incremental"] = resultado["metricas"]
+
+    for nombre, corrida in corridas.items():
+        corrida["inicio"] = str(corrida["inicio"])
+        corrida["fin"] = str(corrida["fin"])
+
+    return {
+        "escala": escala,
+        "filas": rutas["filas"],
+        "funciones": funciones,
+        "main": corridas,
+    }
+
+
+def imprimir_resumen(resultados):
+    filas = []
+    for r in resultados:
+        fila = {"escala": r["escala"], **r["funciones"]}
+        for nombre, corrida in r["main"].items():
+            fila[nombre] = corrida["segundos"]
+        filas.append(fila)
+
+    print("\n" + pd.DataFrame(filas).set_index("escala").T.to_string())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--escalas", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--database-url", default=None, help="por defecto SQLite temporal")
+    parser.add_argument("--formato-gastos", choices=["xlsx", "xls"], default="xlsx")
+    parser.add_argument("--repeticiones", type=int, default=1)
+    parser.add_argument("--salida", default=None, help="JSON de resultados")
+    parser.add_argument("--paralelo", action="store_true", help="main() con pool de procesos")
+    args = parser.parse_args()
+
+    trabajo = tempfile.mkdtemp(prefix="kairos_bench_")
+    uploads_dir = os.path.join(trabajo, "uploads")
+    os.makedirs(uploads_dir)
+
+    sqlite_path = None
+    if args.database_url is None:
+        sqlite_path = os.path.join(trabajo, "kairos_bench.db")
+        args.database_url = f"sqlite:///{sqlite_path}"
+
+    # antes de importar el ETL: carpeta de entrada y base de destino
+    os.environ["KAIROS_UPLOADS_DIR"] = uploads_dir
+    os.environ["DATABASE_URL"] = args.database_url
+    if args.paralelo:
+        os.environ["ETL_PARALELO"] = "1"
+
+    sys.path.insert(0, PROJECT_ROOT)
+    from etl import etl_pipeline as etl
+
+    try:
+        resultados = [
+            correr_escala(etl, escala, uploads_dir, sqlite_path, args.formato_gastos, args.repeticiones)
+            for escala in args.escalas
+        ]
+    finally:
+        shutil.rmtree(trabajo, ignore_errors=True)
+
+    commit = commit_actual()
+    reporte = {
+        "commit": commit,
+        "fecha": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "etl_version": etl.ETL_VERSION,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "cpus": os.cpu_count(),
+        "plataforma": platform.platform(),
+        "motor": args.database_url.split(":", 1)[0],
+        "resultados": resultados,
+    }
+
+    salida = args.salida
+    if salida is None:
+        os.makedirs(RESULTADOS_DIR, exist_ok=True)
+        sello = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
+        salida = os.path.join(RESULTADOS_DIR, f"{commit or 'sin_commit'}_{sello}.json")
+
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(reporte, f, indent=2, ensure_ascii=False, default=str)
+
+    imprimir_resumen(resultados)
+    print(f"\nResultados: {salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Genera archivos sintéticos con la forma de los exports reales de Kairos:
+ventas.xlsx (Transacciones / Items / Secciones), gastos.xls(x) y
+costo_unitario.xlsx. Mismos nombres de columna, fila de título arriba,
+fechas "HH:MM dd/mm/aaaa", secciones con emojis, "PÏZZA", filas sin total...
+
+Escala 1 = volumen actual del export real; 10 y 100 simulan la historia
+que se va acumulando.
+
+    python bench/generar_datos.py --escala 10 --destino /tmp/kairos_x10
+"""
+
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+# volumen del export real (feb-2026) = escala 1
+FILAS_BASE = {
+    "transacciones": 2000,
+    "items": 6500,
+    "gastos": 350,
+    "costos": 165,
+}
+
+DIAS_BASE = 130
+
+INICIO_VENTAS = pd.Timestamp("2025-10-01")
+INICIO_GASTOS = pd.Timestamp("2025-08-01")  # incluye pre-operación
+
+TITULO_VENTAS = "Transacciones 00:00 01/01/2025 - 23:59 31/12/2026"
+TITULO_GASTOS = "Gastos 00:00 01/01/2025 a 23:59 31/12/2026 (01/01/2025 - 31/12/2026)"
+
+# (sección, ítems, precio base)
+SECCIONES = [
+    ("Pastelería", ["Torta del día", "Cheesecake frutos rojos", "Brownie", "Kuchen de nuez"], 3500),
+    ("Café", ["Americano", "Cortado", "Capuccino", "Latte"], 2800),
+    ("🌟 Diferenciadores (Experiencia Café Kairós)", ["Mocca negro", "Latte Kairós"], 3900),
+    ("🌟 Diferenciadores (Bebidas Frías)", ["Espresso naranja", "Cold brew"], 4200),
+    ("Bollería", ["Croissant", "Pan de chocolate"], 2200),
+    ("Jugos naturales", ["Jugo naranja", "Jugo frutilla"], 3200),
+    ("Sándwiches", ["Focaccia Kairós", "Ave palta"], 4700),
+    ("Helados", ["Helado 1 bola", "Helado 2 bolas"], 2500),
+    ("Waffles", ["Waffle clásico", "Waffle frutos rojos"], 4500),
+    ("Pizza de la casa", ["Pizza margarita", "Pizza pepperoni"], 8900),
+    ("☕️ Carta de té Infusiones - Adagio Teas", ["Infusión berries", "Manzanilla"], 2600),
+    ("☕️ Carta de tés matcha - Adagio Teas", ["Matcha latte"], 3900),
+    ("Promoción Lunes \"Café + Torta del día\"", ["Café + Torta"], 5000),
+    ("Momento Kairós - Fotografía", ["Sesión foto"], 10000),
+]
+
+TIPOS_GASTO = [
+    ("INSUMO", 151), ("IMPLEMENTACIÓN", 68), ("PASTELERÍA", 42), ("SERVICIOS", 15),
+    ("LUZ", 10), ("ARRIENDO", 10), ("AGUA", 9), ("GASTOS COMUNES", 9),
+    ("COMISIONES VENTAS", 7), ("REMUNERACIONES", 6), ("CAFÉ", 5), ("PIZZA", 4),
+    ("PÏZZA", 4), ("SOFTWARE", 3), ("TÉ", 3),
+]
+
+PROVEEDORES = [
+    "WALMART CHILE MAYORISTA LIMITADA", "MercadoLibre Chile LTDA", "OLIVIA PASTELERÍA SPA",
+    "Comercial Lomas Coloradas Ltda", "Comercial Campos  Parra Limitada", "RAFFIA SPA",
+    "SODIMAC S.A.", "CHILENA DE CAFES SpA", "BOZZO S.A.", None,
+]
+
+DIAS_SEMANA = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+CAJEROS = ["Catalina Briones", "Sergio Erices", "Fernanda Muñoz"]
+METODOS_PAGO = ["Debito", "Credito", "Efectivo", "Transferencia"]
+
+# proporción de filas "sucias" que el ETL debe descartar
+PROPORCION_SIN_TOTAL = 0.005
+PROPORCION_FECHA_MALA = 0.002
+
+
+def _fechas_hora(rng, inicio, dias, n):
+    """Timestamps ordenados entre 08:00 y 20:00 de `dias` días desde `inicio`."""
+    dia = np.sort(rng.integers(0, dias, n))
+    minutos = rng.integers(8 * 60, 20 * 60, n)
+    return inicio + pd.to_timedelta(dia, unit="D") + pd.to_timedelta(minutos, unit="m")
+
+
+def _texto_fecha(ts):
+    return ts.strftime("%H:%M %d/%m/%Y")
+
+
+def _ensuciar(rng, serie, proporcion, valor):
+    mascara = rng.random(len(serie)) < proporcion
+    serie = serie.astype(object)
+    serie[mascara] = valor
+    return serie
+
+
+def catalogo(escala):
+    """(sección, ítem, precio) con ~FILAS_BASE["costos"] * escala ítems."""
+    filas = []
+    objetivo = FILAS_BASE["costos"] * escala
+    variante = 0
+
+    while len(filas) < objetivo:
+        for seccion, items, precio in SECCIONES:
+            for item in items:
+                nombre = item if variante == 0 else f"{item} {variante + 1}"
+                filas.append((seccion, nombre, precio + 100 * (variante % 7)))
+        variante += 1
+
+    return pd.DataFrame(filas[:objetivo], columns=["seccion", "item", "precio"])
+
+
+def generar_ventas(escala, rng):
+    """DataFrames de las hojas Transacciones, Items y Secciones."""
+    n_trx = FILAS_BASE["transacciones"] * escala
+    n_items = FILAS_BASE["items"] * escala
+    dias = DIAS_BASE * escala
+
+    ingreso = _fechas_hora(rng, INICIO_VENTAS, dias, n_trx)
+    duracion = pd.to_timedelta(rng.integers(60, 2 * 3600, n_trx), unit="s")
+    completado = ingreso + duracion
+
+    trx = pd.DataFrame({
+        "#": np.arange(1, n_trx + 1),
+        "Fecha ingreso": _texto_fecha(ingreso),
+        "Fecha completado": _texto_fecha(completado),
+        "Duración": [f"{int(s) // 3600:02d}:{int(s) % 3600 // 60:02d}:{int(s) % 60:02d}" for s in duracion.total_seconds()],
+        "Día": [DIAS_SEMANA[d] for d in completado.dayofweek],
+        "Semana": completado.isocalendar().week.astype(str).to_numpy(),
+        "Ingresada por": rng.choice(CAJEROS, n_trx),
+        "Cliente": None,
+        "Correo": None,
+        "Teléfono": None,
+        "Tipo venta": rng.choice(["Servir", "Llevar"], n_trx, p=[0.8, 0.2]),
+    })
+
+    # ítems: cada fila cae en una transacción
+    cat = catalogo(escala)
+    trx_de_item = np.sort(rng.integers(0, n_trx, n_items))
+    elegidos = cat.iloc[rng.integers(0, len(cat), n_items)].reset_index(drop=True)
+
+    items = trx.iloc[trx_de_item].reset_index(drop=True).copy()
+    items["Item"] = elegidos["item"]
+    items["Sección"] = elegidos["seccion"]
+    items["Comentario item"] = None
+    items["Precio"] = elegidos["precio"].to_numpy()
+    items["Descuento al total"] = 0
+    items["Comentario pedido"] = None
+
+    totales = items.groupby(trx_de_item)["Precio"].sum().reindex(range(n_trx), fill_value=0)
+
+    trx["Mesa"] = [f"Mesa T {m}" for m in rng.integers(1, 15, n_trx)]
+    trx["Total"] = totales.to_numpy()
+    trx["Subtotal sin costo de reparto"] = trx["Total"]
+    trx["Método de pago"] = rng.choice(METODOS_PAGO, n_trx)
+    trx["Repartidor"] = None
+    trx["Dirección"] = None
+    trx["Costo reparto"] = 0
+    trx["Descuento al total"] = 0
+    trx["Total propina"] = (trx["Total"] * 0.1).round(0).astype(int)
+    trx["Método de pago propina"] = trx["Método de pago"]
+    trx["Comentario"] = None
+    trx["Boleta Electrónica"] = "No"
+    trx["Total boleta"] = None
+    trx["IVA"] = 0
+
+    # filas sucias
+    trx["Total"] = _ensuciar(rng, trx["Total"], PROPORCION_SIN_TOTAL, None)
+    trx["Fecha completado"] = _ensuciar(rng, trx["Fecha completado"], PROPORCION_FECHA_MALA, "—")
+    items["Fecha completado"] = _ensuciar(rng, items["Fecha completado"], PROPORCION_FECHA_MALA, "—")
+
+    secciones = (
+        items.groupby("Sección", sort=False)["Precio"].sum()
+        .rename("Total").reset_index()
+    )
+
+    return {"Transacciones": trx, "Items": items, "Secciones": secciones}, cat
+
+
+def generar_gastos(escala, rng):
+    n = FILAS_BASE["gastos"] * escala
+    dias = (DIAS_BASE + 60) * escala
+
+    tipos, pesos = zip(*TIPOS_GASTO)
+    pesos = np.array(pesos) / sum(pesos)
+
+    fechas = _fechas_hora(rng, INICIO_GASTOS, dias, n)
+
+    df = pd.DataFrame({
+        "Tipo": rng.choice(tipos, n, p=pesos),
+        "Método de pago": "Indefinido",
+        "Comentario": rng.choice(np.array(PROVEEDORES, dtype=object), n),
+        "Total": rng.integers(2000, 600000, n).astype(float),
+        "Fecha": _texto_fecha(fechas),
+    })
+    df["Total"] = _ensuciar(rng, df["Total"], PROPORCION_SIN_TOTAL, None)
+    return df
+
+
+def _escribir_xlsx(ruta, hojas, titulo):
+    with pd.ExcelWriter(ruta, engine="xlsxwriter") as writer:
+        for nombre, df in hojas.items():
+            df.to_excel(writer, sheet_name=nombre, startrow=1 if titulo else 0, index=False)
+            if titulo:
+                writer.sheets[nombre].write(0, 0, titulo)
+
+
+def _escribir_xls(ruta, df, titulo):
+    """gastos.xls como lo exporta el sistema (requiere xlwt)."""
+    import xlwt
+
+    libro = xlwt.Workbook(encoding="cp1252")
+    hoja = libro.add_sheet("Gastos")
+    hoja.write(0, 0, titulo)
+
+    for c, columna in enumerate(df.columns):
+        hoja.write(1, c, columna)
+
+    for r, fila in enumerate(df.itertuples(index=False), start=2):
+        for c, valor in enumerate(fila):
+            if valor is not None and not (isinstance(valor, float) and np.isnan(valor)):
+                hoja.write(r, c, valor)
+
+    libro.save(ruta)
+
+
+def generar(escala, destino, formato_gastos="xlsx", semilla=42):
+    """Escribe los tres archivos en `destino` y devuelve {fuente: ruta}."""
+    os.makedirs(destino, exist_ok=True)
+    rng = np.random.default_rng(semilla)
+
+    hojas, cat = generar_ventas(escala, rng)
+    ruta_ventas = os.path.join(destino, "ventas.xlsx")
+    _escribir_xlsx(ruta_ventas, hojas, TITULO_VENTAS)
+
+    gastos = generar_gastos(escala, rng)
+    if formato_gastos == "xls":
+        ruta_gastos = os.path.join(destino, "gastos.xls")
+        _escribir_xls(ruta_gastos, gastos, TITULO_GASTOS)
+    else:
+        ruta_gastos = os.path.join(destino, "gastos.xlsx")
+        _escribir_xlsx(ruta_gastos, {"Gastos": gastos}, TITULO_GASTOS)
+
+    # no dejar el otro formato de una corrida anterior (el ETL toma el más reciente)
+    otro = os.path.join(destino, "gastos.xlsx" if formato_gastos == "xls" else "gastos.xls")
+    if os.path.exists(otro):
+        os.remove(otro)
+
+    costos = pd.DataFrame({
+        "Sección": cat["seccion"],
+        "Ítem": cat["item"],
+        "Costo unitario": (cat["precio"] * 0.35).round(0).astype(int),
+    })
+    ruta_costos = os.path.join(destino, "costo_unitario.xlsx")
+    _escribir_xlsx(ruta_costos, {"Items conteo": costos}, None)
+
+    return {
+        "ventas": ruta_ventas,
+        "gastos": ruta_gastos,
+        "costos": ruta_costos,
+        "filas": {
+            "transacciones": len(hojas["Transacciones"]),
+            "items": len(hojas["Items"]),
+            "secciones": len(hojas["Secciones"]),
+            "gastos": len(gastos),
+            "costos": len(costos),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--escala", type=int, default=1)
+    parser.add_argument("--destino", required=True)
+    parser.add_argument("--formato-gastos", choices=["xlsx", "xls"], default="xlsx")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    rutas = generar(args.escala, args.destino, args.formato_gastos, args.semilla)
+    print(rutas)
@@ -1,6 +1,18 @@
 import os
+import io
+import time
+import uuid
+import csv
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text, bindparam, DateTime
+from sqlalchemy import types as sqltypes
 
 
 # =====================================================
@@ -10,7 +22,8 @@ from sqlalchemy import create_engine
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(BASE_DIR)
 
-UPLOADS_DIR = os.path.join(PROJECT_ROOT, "uploads")
+# KAIROS_UPLOADS_DIR permite apuntar el ETL a otra carpeta (ej: benchmarks)
+UPLOADS_DIR = os.environ.get("KAIROS_UPLOADS_DIR") or os.path.join(PROJECT_ROOT, "uploads")
 DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 
 
@@ -34,13 +47,6 @@ GASTOS_CANDIDATOS = [
     os.path.join(DATA_DIR, "gastos.xls"),
 ]
 
-RUTA_GASTOS = obtener_archivo_reciente(GASTOS_CANDIDATOS)
-
-if RUTA_GASTOS:
-    print("DEBUG RUTA_GASTOS:", RUTA_GASTOS)
-else:
-    print("⚠️ No se encontró archivo de gastos al iniciar ETL.")
-
 
 # ---------------------------------
 # VENTAS
@@ -52,16 +58,6 @@ VENTAS_CANDIDATOS = [
     os.path.join(DATA_DIR, "transacciones.xlsx"),
 ]
 
-RUTA_VENTAS = next(
-    (p for p in VENTAS_CANDIDATOS if os.path.exists(p)),
-    None
-)
-
-if RUTA_VENTAS:
-    print("DEBUG RUTA_VENTAS:", RUTA_VENTAS)
-else:
-    print("⚠️ No se encontró archivo de ventas al iniciar ETL.")
-
 
 # ---------------------------------
 # COSTO UNITARIO
@@ -73,31 +69,20 @@ COSTO_CANDIDATOS = [
     os.path.join(DATA_DIR, "costo unitario.xlsx"),
 ]
 
-RUTA_COSTO = next(
-    (p for p in COSTO_CANDIDATOS if os.path.exists(p)),
-    None
-)
-
-if RUTA_COSTO:
-    print("DEBUG RUTA_COSTO:", RUTA_COSTO)
-else:
-    print("⚠️ No se encontró archivo de costo unitario al iniciar ETL.")
 
-# =====================================================
-# VALIDA RUTAS
-# =====================================================
-
-
-#if not os.path.exists(RUTA_GASTOS) or not os.path.exists(RUTA_VENTAS):
-#    print("No hay archivos cargados aún.")
-#    exit()
-# =====================================================
-# VALIDACIÓN ARCHIVOS
-# =====================================================
+# ---------------------------------
+# RESOLUCIÓN (en cada corrida, no al importar)
+# ---------------------------------
+# Streamlit mantiene el módulo importado entre cargas: si las rutas se
+# fijaran al importar, un gastos.xlsx subido después de un .xls no se vería.
 
-#if not os.path.exists(RUTA_GASTOS) or not os.path.exists(RUTA_VENTAS):
-#    print("No hay archivos cargados aún.")
-#    exit()
+def buscar_fuentes():
+    """Ruta vigente de cada fuente (None si no hay archivo)."""
+    return {
+        "gastos": obtener_archivo_reciente(GASTOS_CANDIDATOS),
+        "ventas": next((p for p in VENTAS_CANDIDATOS if os.path.exists(p)), None),
+        "costos": next((p for p in COSTO_CANDIDATOS if os.path.exists(p)), None),
+    }
 
 
 # =====================================================
@@ -119,12 +104,91 @@ def limpiar_columnas(df):
     return df
 
 
+FORMATO_FECHA = "%d/%m/%Y"
+
+# textos que ya son "vacío" y no cuentan como fechas mal formadas
+_FECHAS_VACIAS = ["nan", "NaT", "None", ""]
+
+
 def limpiar_fecha(col):
-    return pd.to_datetime(
-        col.astype(str).str[-10:],
-        dayfirst=True,
-        errors="coerce"
-    )
+    """
+    Parsea los últimos 10 caracteres como dd/mm/aaaa. Solo se parsean los
+    textos distintos (una venta por fila repite mucho la fecha) y lo que no
+    calza con el formato se intenta por inferencia y se informa.
+    """
+    texto = col.astype(str).str[-10:]
+    codigos, unicos = pd.factorize(texto)
+    unicos = pd.Index(unicos)
+
+    fechas = pd.to_datetime(unicos, format=FORMATO_FECHA, errors="coerce").to_numpy(copy=True)
+
+    fallidas = pd.isna(fechas) & ~unicos.isin(_FECHAS_VACIAS)
+    if fallidas.any():
+        inferidas = pd.to_datetime(unicos[fallidas], dayfirst=True, errors="coerce").to_numpy()
+        fechas[fallidas] = inferidas.astype(fechas.dtype)
+
+        print(
+            f"⚠️ {col.name}: {int(fallidas.sum())} fechas sin formato dd/mm/aaaa "
+            f"(ej: {list(unicos[fallidas][:3])}); "
+            f"{int(pd.notna(inferidas).sum())} parseadas por inferencia."
+        )
+
+    # código -1 (NaN original) queda como NaT
+    fechas = np.append(fechas, np.datetime64("NaT"))
+    return pd.Series(fechas[codigos], index=col.index, name=col.name)
+
+
+def con_conteo(df, filas_leidas):
+    """Anota en df.attrs cuántas filas se leyeron y cuántas se descartaron."""
+    df.attrs["filas_leidas"] = int(filas_leidas)
+    df.attrs["filas_descartadas"] = int(filas_leidas - len(df))
+    return df
+
+
+# =====================================================
+# POLÍTICA DE TIPOS (ETL y app)
+# =====================================================
+# Texto que se repite en cada fila -> category; montos en CLP (sin
+# centavos) -> int64; el resto de los enteros se achica. El tipo SQL sale
+# de la política y no del dato, para que una carga incremental no choque
+# con una columna creada más angosta por otro lote.
+
+COLUMNAS_CATEGORIA = [
+    "seccion", "item", "grupo_1", "grupo_2", "clasificacion", "tipo",
+    "metodo_de_pago", "metodo_de_pago_propina", "tipo_venta", "ingresada_por",
+    "mesa", "boleta_electronica", "dia", "mes_nombre",
+]
+
+COLUMNAS_MONTO = [
+    "total", "subtotal_sin_costo_de_reparto", "costo_reparto",
+    "descuento_al_total", "total_propina", "total_boleta", "iva",
+    "total_sin_iva", "precio", "costo_unitario",
+]
+
+# enteros chicos por definición (calendario); el resto de los enteros -> INTEGER
+COLUMNAS_SMALLINT = ["anio", "mes", "semana", "trimestre", "dia"]
+
+
+def compactar_tipos(df):
+    """Aplica la política de tipos a `df` (en el lugar) y lo devuelve."""
+    for col in df.columns:
+        serie = df[col]
+
+        if col in COLUMNAS_MONTO and not isinstance(serie.dtype, pd.CategoricalDtype):
+            montos = pd.to_numeric(serie, errors="coerce").round(0)
+            df[col] = montos.astype("Int64" if montos.isna().any() else "int64")
+
+        elif col in COLUMNAS_CATEGORIA and (
+            pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie)
+        ):
+            df[col] = serie.astype("category")
+
+        elif pd.api.types.is_integer_dtype(serie) and not pd.api.types.is_extension_array_dtype(serie):
+            df[col] = pd.to_numeric(serie, downcast="integer")
+
+    return df
+
+
 # =====================================================
 # ELIMINAR EMOJIS
 # =====================================================
@@ -145,20 +209,156 @@ def normalizar_texto(texto: str) -> str:
     return texto.upper().strip()
 
 
+# =====================================================
+# CLASIFICACIÓN GASTOS (tablas de mapeo)
+# =====================================================
+
+# GRUPO 1 (según Excel): estos tipos se agrupan en OTROS
+GASTOS_TIPOS_GRUPO_1_OTROS = [
+    "COMISIONES VENTAS",
+    "INSUMO",
+    "IMPLEMENTACIÓN",
+    "SERVICIOS",
+    "SOFTWARE",
+    "REMUNERACIONES",
+    "ARRIENDO",
+    "LUZ",
+    "AGUA",
+    "GASTOS COMUNES"
+]
+
+# GRUPO 2: tipo -> grupo (los tipos no listados se mantienen)
+GASTOS_TIPO_A_GRUPO_2 = {
+    "COMISIONES VENTAS": "ADMINISTRATIVOS",
+    "INSUMO": "OTROS INSUMOS",
+    "SERVICIOS": "ADMINISTRATIVOS",
+    "SOFTWARE": "ADMINISTRATIVOS",
+    "REMUNERACIONES": "ADMINISTRATIVOS",
+}
+
+# CAPEX (inversión real)
+CAPEX_PROVEEDORES = [
+    "CHILENA DE CAFES SpA",
+    "CONSTRUCTORA CELSA SPA",
+    "FABRICA DE MUEBLES INTERKITT LIMITADA",
+    "BOZZO S.A."
+]
+
+# Variables operativas
+GASTOS_TIPOS_OPEX_VARIABLE = [
+    "COMISIONES VENTAS",
+    "PIZZA",
+    "INSUMO",
+    "CAFÉ",
+    "TÉ",
+    "PASTELERÍA"
+]
+
+
+def clasificar_gastos(df, fecha_inicio_operacion):
+    """Agrega grupo_1, grupo_2 y clasificacion (por columnas, sin apply)."""
+
+    tipo = df["tipo"]
+
+    df["grupo_1"] = tipo.where(~tipo.isin(GASTOS_TIPOS_GRUPO_1_OTROS), "OTROS")
+    df["grupo_2"] = tipo.replace(GASTOS_TIPO_A_GRUPO_2)
+
+    # -----------------------
+    # CLASIFICACIÓN FINANCIERA (el orden define la prioridad)
+    # -----------------------
+    condiciones = [
+        df["comentario"].isin(CAPEX_PROVEEDORES).to_numpy(),     # 1) CAPEX
+        (df["fecha"] < fecha_inicio_operacion).to_numpy(),        # 2) PRE-OPERACIÓN
+        tipo.isin(GASTOS_TIPOS_OPEX_VARIABLE).to_numpy(),         # 3) Variables operativas
+    ]
+    df["clasificacion"] = np.select(
+        condiciones,
+        ["CAPEX", "PRE_OPERACION", "OPEX_VARIABLE"],
+        default="OPEX_FIJO"              # 4) Fijos operativos
+    )
+
+    return df
+
+
+# =====================================================
+# LECTURA XLS (columnar, una sola decodificación)
+# =====================================================
+
+def hoja_xls_a_df(book, sheet_index: int, skiprows: int) -> pd.DataFrame:
+    """Arma el DataFrame de una hoja por columnas; numéricas directo a float64."""
+    import xlrd
+
+    sh = book.sheet_by_index(sheet_index)
+
+    # skiprows (tu excel viene con fila extra arriba) + header
+    if sh.nrows - skiprows < 2:
+        raise ValueError("XLS vacío o sin filas suficientes luego de skiprows.")
+
+    header = [str(x).strip().lower() for x in sh.row_values(skiprows)]
+    inicio = skiprows + 1
+
+    columnas = {}
+    for c in range(sh.ncols):
+        valores = sh.col_values(c, start_rowx=inicio)
+        tipos = set(sh.col_types(c, start_rowx=inicio))
+
+        if tipos and tipos <= {xlrd.XL_CELL_NUMBER, xlrd.XL_CELL_EMPTY}:
+            columnas[c] = np.array(
+                [np.nan if v == "" else v for v in valores],
+                dtype="float64"
+            )
+        else:
+            columnas[c] = valores
+
+    df = pd.DataFrame(columnas)
+    df.columns = header
+    return df
+
+
+def leer_xls(path: str, sheet_index: int = 0, skiprows: int = 1) -> pd.DataFrame:
+    """
+    Lee .xls con xlrd por columnas (evita read_excel que revienta en
+    UnicodeDecodeError). El libro se abre on_demand: la hoja recién se
+    decodifica en sheet_by_index, así que cada encoding se prueba con la
+    lectura completa. Primero el del registro CODEPAGE, después los típicos
+    de los exports chilenos.
+    """
+    import xlrd
+
+    last_err = None
+    for enc in (None, "cp1252", "latin1"):
+        try:
+            book = xlrd.open_workbook(path, on_demand=True, encoding_override=enc)
+        except (UnicodeDecodeError, LookupError) as e:
+            last_err = e
+            continue
+
+        try:
+            return hoja_xls_a_df(book, sheet_index, skiprows)
+        except (UnicodeDecodeError, LookupError) as e:
+            last_err = e
+        finally:
+            book.release_resources()
+
+    raise RuntimeError(f"No se pudo leer XLS (fallaron encodings). Último error: {last_err}")
+
+
 # =====================================================
 # GASTOS
 # =====================================================
-def procesar_gastos():
+def procesar_gastos(ruta=None):
 
-    if RUTA_GASTOS is None:
+    ruta = ruta or buscar_fuentes()["gastos"]
+
+    if ruta is None:
         raise FileNotFoundError("No se encontró archivo de gastos.")
 
     # DEBUG IMPORTANTE (Render)
     print("=== DEBUG GASTOS ===")
-    print("Archivo detectado:", RUTA_GASTOS)
+    print("Archivo detectado:", ruta)
 
     try:
-        print("Tamaño archivo:", os.path.getsize(RUTA_GASTOS))
+        print("Tamaño archivo:", os.path.getsize(ruta))
     except:
         print("No se pudo obtener tamaño del archivo")
 
@@ -167,50 +367,14 @@ def procesar_gastos():
     # =================================================
     # LECTURA ROBUSTA XLS / XLSX
     # =================================================
-    ext = os.path.splitext(RUTA_GASTOS.lower())[1]
+    ext = os.path.splitext(ruta.lower())[1]
 
     if ext == ".xlsx":
         # xlsx => openpyxl
-        df = pd.read_excel(RUTA_GASTOS, sheet_name=0, skiprows=1, engine="openpyxl")
+        df = pd.read_excel(ruta, sheet_name=0, skiprows=1, engine="openpyxl")
 
     elif ext == ".xls":
-        import xlrd
-
-        def _read_xls_robusto(path: str, sheet_index: int = 0, skiprows: int = 1) -> pd.DataFrame:
-            """
-            Lee .xls con xlrd probando encodings típicos para archivos con caracteres raros.
-            Construye DataFrame manualmente (evita read_excel que revienta en UnicodeDecodeError).
-            """
-            last_err = None
-            for enc in (None, "latin1", "cp1252"):
-                try:
-                    if enc is None:
-                        book = xlrd.open_workbook(path)
-                    else:
-                        book = xlrd.open_workbook(path, encoding_override=enc)
-
-                    sh = book.sheet_by_index(sheet_index)
-
-                    rows = [sh.row_values(r) for r in range(sh.nrows)]
-
-                    # skiprows (tu excel viene con fila extra arriba)
-                    rows = rows[skiprows:]
-
-                    if not rows or len(rows) < 2:
-                        raise ValueError("XLS vacío o sin filas suficientes luego de skiprows.")
-
-                    # header = primera fila después de skip
-                    header = [str(x).strip().lower() for x in rows[0]]
-                    data = rows[1:]
-
-                    return pd.DataFrame(data, columns=header)
-
-                except Exception as e:
-                    last_err = e
-
-            raise RuntimeError(f"No se pudo leer XLS (fallaron encodings). Último error: {last_err}")
-
-        df = _read_xls_robusto(RUTA_GASTOS, sheet_index=0, skiprows=1)
+        df = leer_xls(ruta, sheet_index=0, skiprows=1)
 
     else:
         raise ValueError(f"Extensión de gastos no soportada: {ext}")
@@ -220,6 +384,7 @@ def procesar_gastos():
     # =================================================
 
     df = limpiar_columnas(df)
+    filas_leidas = len(df)
 
     df.columns = df.columns.str.strip().str.lower()
 
@@ -230,97 +395,96 @@ def procesar_gastos():
 
     df["tipo"] = df["tipo"].replace("PÏZZA", "PIZZA")
 
-    # -----------------------
-    # GRUPO 1 (según Excel)
-    # -----------------------
-    def grupo_1(row):
-        if row["tipo"] in [
-            "COMISIONES VENTAS",
-            "INSUMO",
-            "IMPLEMENTACIÓN",
-            "SERVICIOS",
-            "SOFTWARE",
-            "REMUNERACIONES",
-            "ARRIENDO",
-            "LUZ",
-            "AGUA",
-            "GASTOS COMUNES"
-        ]:
-            return "OTROS"
-        return row["tipo"]
-
-    df["grupo_1"] = df.apply(grupo_1, axis=1)
+    df = clasificar_gastos(df, FECHA_INICIO_OPERACION)
 
-    # -----------------------
-    # GRUPO 2
-    # -----------------------
-    def grupo_2(row):
-        if row["tipo"] == "COMISIONES VENTAS":
-            return "ADMINISTRATIVOS"
-        elif row["tipo"] == "INSUMO":
-            return "OTROS INSUMOS"
-        elif row["tipo"] in ["SERVICIOS", "SOFTWARE", "REMUNERACIONES"]:
-            return "ADMINISTRATIVOS"
-        return row["tipo"]
+    # ✅ OJO: eliminamos fecha_2 porque dependía de clasificacion y ya no aplica.
 
-    df["grupo_2"] = df.apply(grupo_2, axis=1)
+    return con_conteo(compactar_tipos(df.reset_index(drop=True)), filas_leidas)
 
-    # -----------------------
-    # CLASIFICACIÓN FINANCIERA (NUEVA)
-    # -----------------------
-    def clasificacion_financiera(row):
-        # 1) CAPEX (inversión real)
-        CAPEX_PROVEEDORES = [
-    "CHILENA DE CAFES SpA",
-    "CONSTRUCTORA CELSA SPA",
-    "FABRICA DE MUEBLES INTERKITT LIMITADA",
-    "BOZZO S.A."
-]
+# =====================================================
+# LIBRO VENTAS (una sola lectura)
+# =====================================================
 
-        if row["comentario"] in CAPEX_PROVEEDORES:
-            return "CAPEX"
+HOJAS_VENTAS = ["Transacciones", "Items", "Secciones"]
 
-        # 2) PRE-OPERACIÓN (antes de abrir)
-        if row["fecha"] < FECHA_INICIO_OPERACION:
-            return "PRE_OPERACION"
 
-        # 3) Variables operativas
-        if row["tipo"] in [
-            "COMISIONES VENTAS",
-            "PIZZA",
-            "INSUMO",
-            "CAFÉ",
-            "TÉ",
-            "PASTELERÍA"
-        ]:
-            return "OPEX_VARIABLE"
+def leer_libro_ventas(ruta=None):
+    """
+    Abre ventas.xlsx una sola vez y devuelve {hoja: DataFrame crudo}
+    para Transacciones, Items y Secciones.
+    """
+    ruta = ruta or buscar_fuentes()["ventas"]
 
-        # 4) Fijos operativos
-        return "OPEX_FIJO"
+    if ruta is None:
+        raise FileNotFoundError("No se encontró archivo de ventas.")
 
-    df["clasificacion"] = df.apply(clasificacion_financiera, axis=1)
+    with pd.ExcelFile(ruta, engine="openpyxl") as libro:
+        return {
+            hoja: pd.read_excel(libro, sheet_name=hoja, skiprows=1)
+            for hoja in HOJAS_VENTAS
+        }
 
-    # ✅ OJO: eliminamos fecha_2 porque dependía de clasificacion y ya no aplica.
 
-    return df.reset_index(drop=True)
+# =====================================================
+# LECTURA STREAMING (memoria constante)
+# =====================================================
+# openpyxl en modo read_only recorre la hoja fila a fila sin cargar el libro
+# completo. Cada bloque se tipa con el mismo TextParser que usa read_excel.
+
+from pandas.io.parsers import TextParser
+
+TAMANO_BLOQUE = 5000
+
+
+def iterar_hoja_por_bloques(ruta, hoja, skiprows=1, tamano=TAMANO_BLOQUE):
+    """Genera DataFrames crudos de a `tamano` filas de la hoja `hoja`."""
+    import openpyxl
+
+    libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+
+    try:
+        filas = libro[hoja].iter_rows(values_only=True)
+
+        for _ in range(skiprows):
+            next(filas, None)
+
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+
+        bloque = []
+        for fila in filas:
+            bloque.append(list(fila))
+
+            if len(bloque) >= tamano:
+                yield TextParser([list(encabezado)] + bloque, header=0).read()
+                bloque = []
+
+        if bloque:
+            yield TextParser([list(encabezado)] + bloque, header=0).read()
+
+    finally:
+        libro.close()
+
 
 # =====================================================
 # TRANSACCIONES
 # =====================================================
 
-def procesar_transacciones():
-    if RUTA_VENTAS is None:
-        raise FileNotFoundError("No se encontró archivo de ventas.")
-    print("=== DEBUG PRODUCCION ===")
-    print("CWD:", os.getcwd())
-    print("Existe uploads/ventas.xlsx:", os.path.exists("uploads/ventas.xlsx"))
-    print("Existe uploads/transacciones.xlsx:", os.path.exists("uploads/transacciones.xlsx"))
-    print("Ruta ventas detectada:", RUTA_VENTAS)
-    print("=========================")
+def procesar_transacciones(df=None, ruta=None):
+    if df is None:
+        ruta = ruta or buscar_fuentes()["ventas"]
+        if ruta is None:
+            raise FileNotFoundError("No se encontró archivo de ventas.")
+        print("=== DEBUG PRODUCCION ===")
+        print("CWD:", os.getcwd())
+        print("Ruta ventas detectada:", ruta)
+        print("=========================")
+
+        df = pd.read_excel(ruta, sheet_name="Transacciones", skiprows=1)
 
-    
-    df = pd.read_excel(RUTA_VENTAS, sheet_name="Transacciones", skiprows=1)
     df = limpiar_columnas(df)
+    filas_leidas = len(df)
 
     df["fecha_completado"] = limpiar_fecha(df["fecha_completado"])
     df.rename(columns={"fecha_completado": "fecha"}, inplace=True)
@@ -331,18 +495,21 @@ def procesar_transacciones():
     df["iva"] = (df["total"] * 0.19).round(0)
     df["total_sin_iva"] = df["total"] - df["iva"]
 
-    return df.reset_index(drop=True)
+    return con_conteo(compactar_tipos(df.reset_index(drop=True)), filas_leidas)
 
 # =====================================================
 # ITEMS
 # =====================================================
 
-def procesar_items():
-    if RUTA_VENTAS is None:
-        raise FileNotFoundError("No se encontró archivo de ventas.")
-    
-    df = pd.read_excel(RUTA_VENTAS, sheet_name="Items", skiprows=1)
+def procesar_items(df=None, ruta=None):
+    if df is None:
+        ruta = ruta or buscar_fuentes()["ventas"]
+        if ruta is None:
+            raise FileNotFoundError("No se encontró archivo de ventas.")
+        df = pd.read_excel(ruta, sheet_name="Items", skiprows=1)
+
     df = limpiar_columnas(df)
+    filas_leidas = len(df)
 
     df["fecha_completado"] = limpiar_fecha(df["fecha_completado"])
     df.rename(columns={"fecha_completado": "fecha"}, inplace=True)
@@ -350,115 +517,108 @@ def procesar_items():
     df["precio"] = pd.to_numeric(df["precio"], errors="coerce")
     df = df.dropna(subset=["fecha", "precio"])
 
-    return df.reset_index(drop=True)
+    return con_conteo(compactar_tipos(df.reset_index(drop=True)), filas_leidas)
 
 # =====================================================
-# SECCIONES
+# CLASIFICACIÓN SECCIONES (palabras clave)
 # =====================================================
 
-def procesar_secciones():
+# GRUPO 2: el orden es la prioridad (PIZZA gana sobre CAFÉ, etc.)
+SECCIONES_GRUPO_2 = [
+    ("PIZZA", ["PIZZA"]),
+    ("HELADOS", ["HELADO"]),
+    ("TÉ", [" TE ", " TES", "TEA", "MATCHA", "INFUSION"]),
+    ("BEBIDAS FRIAS", ["BEBIDA", "BATIDO", "JUGO", "FRIA", "FRIO", "ESPRESSO NARANJA"]),
+    ("CAFÉ", ["CAFE"]),
+    ("PASTELERÍA", ["PASTEL", "CROISSANT", "WAFFLE", "BOLLERIA", "GALLET", "CHEESECAKE", "TORTA"]),
+    ("SANDWICH", ["SANDWICH"]),
+    ("PROMOCIONES", ["PROMOCION"]),
+]
 
-    if RUTA_VENTAS is None:
-        raise FileNotFoundError("No se encontró archivo de ventas.")
+# GRUPO 1: estos grupo_2 se mantienen, el resto va a OTROS
+SECCIONES_GRUPO_1 = ["CAFÉ", "PASTELERÍA", "TÉ", "PIZZA", "SANDWICH"]
+
+# Una alternativa por grupo, cada una con lookahead desde el inicio: la
+# regex prueba las alternativas en orden, así respeta la prioridad de la
+# lista aunque la palabra clave aparezca más a la derecha en el texto.
+_REGEX_GRUPO_2 = re.compile(
+    "^(?:" + "|".join(
+        "(?=.*(?:" + "|".join(re.escape(k) for k in claves) + f"))(?P<g{i}>)"
+        for i, (_, claves) in enumerate(SECCIONES_GRUPO_2)
+    ) + ")",
+    re.DOTALL
+)
 
-    df = pd.read_excel(RUTA_VENTAS, sheet_name="Secciones", skiprows=1)
-    df = limpiar_columnas(df)
 
-    df["total"] = pd.to_numeric(df["total"], errors="coerce")
-    df = df.dropna(subset=["seccion", "total"])
+def grupo_2_seccion(seccion):
+    m = _REGEX_GRUPO_2.match(normalizar_texto(seccion))
+    if m is None:
+        return "OTROS"
+    return SECCIONES_GRUPO_2[int(m.lastgroup[1:])][0]
 
-    # -----------------------
-    # GRUPO 2
-    # -----------------------
-    def grupo_2(seccion):
-
-        s = normalizar_texto(seccion)
-
-        # -------------------------
-        # PIZZA
-        # -------------------------
-        if "PIZZA" in s:
-            return "PIZZA"
-
-        # -------------------------
-        # HELADOS
-        # -------------------------
-        if "HELADO" in s:
-            return "HELADOS"
-
-        # -------------------------
-        # TÉ / TEA / TES
-        # -------------------------
-        if any(x in s for x in [" TE ", " TES", "TEA", "MATCHA", "INFUSION"]):
-            return "TÉ"
-
-        # -------------------------
-        # BEBIDAS FRIAS
-        # -------------------------
-        if any(x in s for x in ["BEBIDA", "BATIDO", "JUGO", "FRIA", "FRIO", "ESPRESSO NARANJA"]):
-            return "BEBIDAS FRIAS"
-
-        # -------------------------
-        # CAFÉ
-        # -------------------------
-        if "CAFE" in s:
-            return "CAFÉ"
-
-        # -------------------------
-        # PASTELERÍA
-        # -------------------------
-        if any(x in s for x in ["PASTEL", "CROISSANT", "WAFFLE", "BOLLERIA", "GALLET", "CHEESECAKE", "TORTA"]):
-            return "PASTELERÍA"
-
-        # -------------------------
-        # SANDWICH
-        # -------------------------
-        if "SANDWICH" in s:
-            return "SANDWICH"
-
-        # -------------------------
-        # PROMOCIONES
-        # -------------------------
-        if "PROMOCION" in s:
-            return "PROMOCIONES"
 
-        return "OTROS"
+def clasificar_secciones(secciones):
+    """
+    (grupo_2, grupo_1) para una Serie de secciones. Se clasifica cada
+    nombre distinto una sola vez y se reparte a las filas con los códigos.
+    """
+    codigos, unicos = pd.factorize(secciones)
 
-    df["grupo_2"] = df["seccion"].apply(grupo_2)
+    etiquetas = np.array([grupo_2_seccion(s) for s in unicos] + ["OTROS"], dtype=object)
+    # código -1 (NaN) apunta al "OTROS" agregado al final
+    grupo_2 = pd.Series(etiquetas[codigos], index=secciones.index)
 
-    # -----------------------
-    # GRUPO 1
-    # -----------------------
-    def grupo_1(row):
-        if row["grupo_2"] in ["CAFÉ", "PASTELERÍA", "TÉ", "PIZZA", "SANDWICH"]:
-            return row["grupo_2"]
-        return "OTROS"
+    grupo_1 = grupo_2.where(grupo_2.isin(SECCIONES_GRUPO_1), "OTROS")
+
+    return grupo_2, grupo_1
+
+
+# =====================================================
+# SECCIONES
+# =====================================================
+
+def procesar_secciones(df=None, ruta=None):
+
+    if df is None:
+        ruta = ruta or buscar_fuentes()["ventas"]
+        if ruta is None:
+            raise FileNotFoundError("No se encontró archivo de ventas.")
+        df = pd.read_excel(ruta, sheet_name="Secciones", skiprows=1)
+
+    df = limpiar_columnas(df)
+    filas_leidas = len(df)
+
+    df["total"] = pd.to_numeric(df["total"], errors="coerce")
+    df = df.dropna(subset=["seccion", "total"])
 
-    df["grupo_1"] = df.apply(grupo_1, axis=1)
+    df["grupo_2"], df["grupo_1"] = clasificar_secciones(df["seccion"])
 
-    return df.reset_index(drop=True)
+    return con_conteo(compactar_tipos(df.reset_index(drop=True)), filas_leidas)
 
 # =====================================================
 # PROCESAR COSTOS UNITARIOS
 # =====================================================
 
-def procesar_costo_unitario():
+def procesar_costo_unitario(ruta=None):
 
-    if RUTA_COSTO is None:
+    ruta = ruta or buscar_fuentes()["costos"]
+
+    if ruta is None:
         print("No existe archivo costo unitario.xlsx")
         return pd.DataFrame(columns=["seccion", "item", "costo_unitario"])
 
     # NO forzamos nombre de hoja
     try:
-        df = pd.read_excel(RUTA_COSTO, sheet_name="Items conteo")
+        df = pd.read_excel(ruta, sheet_name="Items conteo")
     except Exception:
     # fallback: primera hoja si el nombre cambia
-        df = pd.read_excel(RUTA_COSTO)
+        df = pd.read_excel(ruta)
 
     print("Primeras filas crudas:")
     print(df.head())
 
     df = limpiar_columnas(df)
+    filas_leidas = len(df)
 
     print("Columnas detectadas:", df.columns.tolist())
 
@@ -490,15 +650,12 @@ def procesar_costo_unitario():
 
     print("Filas finales costo_unitario:", len(df))
 
-    return df.reset_index(drop=True)
+    return con_conteo(compactar_tipos(df.reset_index(drop=True)), filas_leidas)
 # =====================================================
 # CALENDARIO
 # =====================================================
 
-def crear_calendario(df_ventas, df_gastos):
-
-    fecha_min = min(df_ventas["fecha"].min(), df_gastos["fecha"].min())
-    fecha_max = max(df_ventas["fecha"].max(), df_gastos["fecha"].max())
+def crear_calendario(fecha_min, fecha_max):
 
     calendario = pd.DataFrame({
         "fecha": pd.date_range(fecha_min, fecha_max)
@@ -511,7 +668,1305 @@ def crear_calendario(df_ventas, df_gastos):
     calendario["trimestre"] = calendario["fecha"].dt.quarter
     calendario["dia"] = calendario["fecha"].dt.day
 
-    return calendario
+    return compactar_tipos(calendario)
+
+
+# =====================================================
+# ESCRITURA BULK (COPY en Postgres, multi-insert en el resto)
+# =====================================================
+# to_sql por defecto hace un INSERT por fila: sobre la red a Neon es lo más
+# lento del ETL. En Postgres cada bloque viaja como CSV por COPY FROM STDIN.
+
+FILAS_POR_BLOQUE_COPY = 50000
+
+
+def tipos_sql(df):
+    """Tipos SQL explícitos por columna (evita que cada carga los adivine)."""
+    tipos = {}
+
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            tipos[col] = sqltypes.DateTime()
+        elif pd.api.types.is_bool_dtype(dtype):
+            tipos[col] = sqltypes.Boolean()
+        elif pd.api.types.is_integer_dtype(dtype):
+            if col in COLUMNAS_MONTO:
+                tipos[col] = sqltypes.BigInteger()
+            elif col in COLUMNAS_SMALLINT:
+                tipos[col] = sqltypes.SmallInteger()
+            elif dtype.itemsize < 8:
+                tipos[col] = sqltypes.Integer()
+            else:
+                tipos[col] = sqltypes.BigInteger()
+        elif pd.api.types.is_float_dtype(dtype) and not df[col].isna().all():
+            tipos[col] = sqltypes.Float(precision=53)
+        else:
+            # una columna vacía sale float solo por los NaN: TEXT no le fija un tipo numérico
+            tipos[col] = sqltypes.Text()
+
+    return tipos
+
+
+def _copy_postgres(table, conn, keys, data_iter):
+    """method= de to_sql: envía el bloque con COPY ... FROM STDIN (psycopg2)."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(data_iter)
+    buffer.seek(0)
+
+    columnas = ", ".join(f'"{k}"' for k in keys)
+    nombre = f'"{table.schema}"."{table.name}"' if table.schema else f'"{table.name}"'
+
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(f"COPY {nombre} ({columnas}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def tipos_por_bloques(df):
+    """
+    Tipos SQL fijos para una carga por bloques, tomados del primer bloque con
+    la misma inferencia que tipos_sql (así ambos caminos crean el mismo DDL).
+    Fecha y montos salen de la política aunque el primer bloque venga vacío.
+    """
+    tipos = tipos_sql(df)
+
+    for col in df.columns:
+        if col == "fecha":
+            tipos[col] = sqltypes.DateTime()
+        elif col in COLUMNAS_MONTO:
+            tipos[col] = sqltypes.BigInteger()
+
+    return tipos
+
+
+def ajustar_a_tipos(df, tipos):
+    """
+    Castea las columnas de `df` a los tipos SQL `tipos` (en el lugar). Si un
+    bloque trae texto en una columna numérica, falla en vez de guardar NULL.
+    """
+    for col, tipo in tipos.items():
+        if col not in df.columns:
+            continue
+
+        serie = df[col]
+        if isinstance(tipo, sqltypes.DateTime):
+            df[col] = pd.to_datetime(serie, errors="coerce")
+        elif isinstance(tipo, (sqltypes.Integer, sqltypes.Float)):
+            numeros = pd.to_numeric(serie, errors="coerce")
+            perdidos = numeros.isna() & serie.notna()
+            if perdidos.any():
+                raise ValueError(
+                    f"{col}: valores no numéricos en un bloque (ej: {list(serie[perdidos][:3])}); "
+                    "correr con ETL_STREAMING=0 para inferir el tipo con el export completo."
+                )
+
+            if isinstance(tipo, sqltypes.Integer):
+                df[col] = numeros.round(0).astype("Int64")
+            else:
+                df[col] = numeros.astype("float64")
+        elif isinstance(tipo, (sqltypes.String, sqltypes.Text)) and not (
+            pd.api.types.is_object_dtype(serie)
+            or pd.api.types.is_string_dtype(serie)
+            or isinstance(serie.dtype, pd.CategoricalDtype)
+        ):
+            df[col] = serie.astype("string")
+
+    return df
+
+
+def escribir_tabla(df, tabla, conn, if_exists="replace", tipos=None):
+    """Reemplazo de df.to_sql con carga bulk según el motor de `conn`."""
+    if conn.dialect.name == "postgresql":
+        metodo = _copy_postgres
+        bloque = FILAS_POR_BLOQUE_COPY
+    else:
+        # multi-row INSERT; SQLite limita la cantidad de parámetros por sentencia
+        metodo = "multi"
+        bloque = max(1, 999 // max(1, len(df.columns)))
+
+    df.to_sql(
+        tabla,
+        conn,
+        if_exists=if_exists,
+        index=False,
+        dtype=tipos or tipos_sql(df),
+        method=metodo,
+        chunksize=bloque
+    )
+
+
+# =====================================================
+# CARGA INCREMENTAL (marca de agua por fecha)
+# =====================================================
+# Cada export de ventas trae toda la historia, pero lo nuevo son pocos días.
+# Guardamos por tabla la última fecha cargada y solo se borran / reinsertan
+# los días que el export nuevo pisa.
+
+TABLA_MARCAS = "etl_marcas_agua"
+
+
+def leer_marca_agua(engine, tabla):
+    """Última fecha cargada en `tabla` (None si la tabla no existe)."""
+    insp = inspect(engine)
+
+    if not insp.has_table(tabla):
+        return None
+
+    with engine.connect() as conn:
+        valor = None
+        if insp.has_table(TABLA_MARCAS):
+            valor = conn.execute(
+                text(f"SELECT fecha_max FROM {TABLA_MARCAS} WHERE tabla = :tabla"),
+                {"tabla": tabla}
+            ).scalar()
+
+        # tablas cargadas antes de existir las marcas
+        if valor is None:
+            valor = conn.execute(text(f'SELECT MAX(fecha) FROM "{tabla}"')).scalar()
+
+    return pd.Timestamp(valor) if valor is not None else None
+
+
+def guardar_marca_agua(conn, tabla, fecha_max, filas):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {TABLA_MARCAS} (
+            tabla VARCHAR(64) PRIMARY KEY,
+            fecha_max TIMESTAMP,
+            filas_escritas INTEGER,
+            actualizado TIMESTAMP
+        )
+    """))
+    conn.execute(text(f"DELETE FROM {TABLA_MARCAS} WHERE tabla = :tabla"), {"tabla": tabla})
+    conn.execute(
+        text(
+            f"INSERT INTO {TABLA_MARCAS} (tabla, fecha_max, filas_escritas, actualizado) "
+            "VALUES (:tabla, :fecha_max, :filas, :actualizado)"
+        ).bindparams(
+            bindparam("fecha_max", type_=DateTime()),
+            bindparam("actualizado", type_=DateTime()),
+        ),
+        {
+            "tabla": tabla,
+            "fecha_max": pd.Timestamp(fecha_max).to_pydatetime(),
+            "filas": int(filas),
+            "actualizado": pd.Timestamp.now().to_pydatetime(),
+        }
+    )
+
+
+def ventana_incremental(fechas, marca):
+    """
+    Rango (desde, hasta) de días a reemplazar, o None para reemplazo completo.
+
+    - Export que llega más allá de la marca: desde el último día cargado
+      (puede haber quedado a medias) hasta el final del export.
+    - Export que termina antes de la marca (corrección de meses pasados):
+      se reemplaza su rango completo.
+    """
+    if marca is None or fechas.empty:
+        return None
+
+    export_min = fechas.min()
+    export_max = fechas.max()
+
+    if export_max < marca.normalize():
+        return export_min, export_max
+
+    return max(export_min, marca.normalize()), export_max
+
+
+def columnas_compatibles(engine, tabla, df):
+    columnas_tabla = {c["name"] for c in inspect(engine).get_columns(tabla)}
+    return columnas_tabla == set(df.columns)
+
+
+def preparar_incremental(df, tabla, engine, incremental=True):
+    """
+    Deja en staging las filas de `df` que hay que publicar en `tabla`:
+    solo la ventana de días que cubre el export, o todo si no hay marca.
+    """
+    marca = leer_marca_agua(engine, tabla) if incremental else None
+    ventana = ventana_incremental(df["fecha"], marca)
+
+    if ventana is not None and not columnas_compatibles(engine, tabla, df):
+        print(f"⚠️ Columnas de {tabla} cambiaron, se recarga completa.")
+        ventana = None
+
+    if ventana is None:
+        pub = preparar_reemplazo(df, tabla, engine)
+        pub["marca"] = df["fecha"].max()
+        return pub
+
+    desde, hasta = ventana
+    nuevas = df[(df["fecha"] >= desde) & (df["fecha"] <= hasta)]
+    escribir_tabla(nuevas, nombre_staging(tabla), engine)
+
+    print(f"{tabla}: ventana {desde.date()} → {hasta.date()} ({len(nuevas)} filas)")
+
+    return {
+        "tabla": tabla,
+        "modo": "ventana",
+        "desde": desde,
+        "hasta": hasta,
+        "columnas": list(nuevas.columns),
+        "filas": len(nuevas),
+        "marca": max(marca, hasta),
+    }
+
+
+def preparar_streaming(bloques, procesar, tabla, engine, incremental=True):
+    """
+    Limpia cada bloque de `bloques` y lo escribe en staging apenas se lee.
+
+    Con marca de agua la ventana sale igual que en ventana_incremental, con
+    el mínimo / máximo del export acumulados bloque a bloque: mientras el
+    export no llegue a la marca se guarda todo (puede ser una corrección de
+    meses pasados); al final se recorta staging a la ventana.
+    """
+    marca = leer_marca_agua(engine, tabla) if incremental else None
+    dia_marca = marca.normalize() if marca is not None else None
+
+    escritas = 0
+    leidas = 0
+    descartadas = 0
+    export_min = None
+    export_max = None
+    columnas = None
+    tipos = None
+    stg = nombre_staging(tabla)
+
+    with engine.begin() as conn:
+
+        for crudo in bloques:
+            df = procesar(crudo)
+
+            bloque_leidas, bloque_descartadas = filas_de(df)
+            leidas += bloque_leidas
+            descartadas += bloque_descartadas
+
+            if columnas is None:
+                columnas = list(df.columns)
+                if dia_marca is not None and not columnas_compatibles(engine, tabla, df):
+                    print(f"⚠️ Columnas de {tabla} cambiaron, se recarga completa.")
+                    marca = dia_marca = None
+
+                # el primer bloque fija el esquema de staging para todos
+                tipos = tipos_por_bloques(df)
+                if dia_marca is not None:
+                    # con ventana las filas se insertan en la tabla publicada: sus tipos mandan
+                    tipos.update({
+                        c["name"]: c["type"] for c in inspect(engine).get_columns(tabla)
+                        if c["name"] in tipos
+                    })
+
+            df = ajustar_a_tipos(df, tipos)
+
+            fechas = df["fecha"].dropna()
+            if not fechas.empty:
+                export_min = fechas.min() if export_min is None else min(export_min, fechas.min())
+                export_max = fechas.max() if export_max is None else max(export_max, fechas.max())
+
+            # el export ya pasó la marca: lo anterior a ella queda fuera de la ventana
+            if dia_marca is not None and export_max is not None and export_max >= dia_marca:
+                df = df[df["fecha"] >= dia_marca]
+
+            if df.empty and escritas:
+                continue
+
+            escribir_tabla(
+                df, stg, conn,
+                if_exists="append" if escritas else "replace", tipos=tipos
+            )
+
+            escritas += len(df)
+
+        ventana = None
+        if columnas is not None and export_min is not None:
+            ventana = ventana_incremental(pd.Series([export_min, export_max]), marca)
+
+        if ventana is not None:
+            desde, hasta = ventana
+            # bloques guardados antes de saber hasta dónde llegaba el export
+            conn.execute(
+                text(
+                    f'DELETE FROM "{stg}" WHERE fecha IS NULL '
+                    "OR fecha < :desde OR fecha > :hasta"
+                ).bindparams(
+                    bindparam("desde", type_=DateTime()),
+                    bindparam("hasta", type_=DateTime()),
+                ),
+                {"desde": desde.to_pydatetime(), "hasta": hasta.to_pydatetime()}
+            )
+            escritas = conn.execute(text(f'SELECT COUNT(*) FROM "{stg}"')).scalar()
+
+    if columnas is None:
+        print(f"{tabla}: {escritas} filas en staging por bloques")
+        return None
+
+    if ventana is None:
+        print(f"{tabla}: {escritas} filas en staging por bloques")
+        return {
+            "tabla": tabla,
+            "modo": "reemplazo",
+            "desde": None,
+            "hasta": None,
+            "columnas": columnas,
+            "filas": escritas,
+            "filas_leidas": leidas,
+            "filas_descartadas": descartadas,
+            "marca": export_max,
+        }
+
+    print(f"{tabla}: ventana {desde.date()} → {hasta.date()} ({escritas} filas, por bloques)")
+
+    return {
+        "tabla": tabla,
+        "modo": "ventana",
+        "desde": desde,
+        "hasta": hasta,
+        "columnas": columnas,
+        "filas": escritas,
+        "filas_leidas": leidas,
+        "filas_descartadas": descartadas,
+        "marca": max(marca, hasta),
+    }
+
+
+# =====================================================
+# STAGING + PUBLICACIÓN ATÓMICA
+# =====================================================
+# Cada etapa escribe en stg_<tabla>. Al final, una sola transacción borra /
+# renombra todas las tablas, así el dashboard nunca ve un fact_ventas nuevo
+# junto a un dim_calendario viejo (ni una tabla faltante a mitad de carga).
+
+PREFIJO_STAGING = "stg_"
+
+
+def nombre_staging(tabla):
+    return f"{PREFIJO_STAGING}{tabla}"
+
+
+def crear_engine(database_url):
+    """
+    create_engine con DDL transaccional también en SQLite: pysqlite no abre
+    la transacción antes de un DROP / ALTER, así que se emite BEGIN a mano.
+    """
+    engine = create_engine(database_url)
+
+    if engine.dialect.name == "sqlite":
+
+        @event.listens_for(engine, "connect")
+        def _sin_transaccion_implicita(dbapi_conn, connection_record):
+            dbapi_conn.isolation_level = None
+
+        @event.listens_for(engine, "begin")
+        def _begin(conn):
+            conn.exec_driver_sql("BEGIN")
+
+    return engine
+
+
+def preparar_reemplazo(df, tabla, engine):
+    escribir_tabla(df, nombre_staging(tabla), engine)
+    return {"tabla": tabla, "modo": "reemplazo", "filas": len(df)}
+
+
+def borrar_ventana(conn, tabla, desde, hasta=None):
+    if hasta is None:
+        conn.execute(
+            text(f'DELETE FROM "{tabla}" WHERE fecha >= :desde').bindparams(
+                bindparam("desde", type_=DateTime())
+            ),
+            {"desde": desde.to_pydatetime()}
+        )
+    else:
+        conn.execute(
+            text(f'DELETE FROM "{tabla}" WHERE fecha >= :desde AND fecha <= :hasta').bindparams(
+                bindparam("desde", type_=DateTime()),
+                bindparam("hasta", type_=DateTime()),
+            ),
+            {"desde": desde.to_pydatetime(), "hasta": hasta.to_pydatetime()}
+        )
+
+
+def publicar(engine, publicaciones):
+    """Mueve todas las tablas de staging a producción en una transacción."""
+    publicaciones = [p for p in publicaciones if p is not None]
+
+    if not publicaciones:
+        return
+
+    with engine.begin() as conn:
+        for pub in publicaciones:
+            tabla = pub["tabla"]
+            stg = nombre_staging(tabla)
+
+            if pub.get("particionado"):
+                publicar_particionada(conn, pub)
+
+            else:
+                if tabla in PARTICIONABLES and es_particionada(conn, tabla):
+                    # se volvió al layout de tabla única
+                    desparticionar(conn, tabla, conservar=pub["modo"] == "ventana")
+
+                if pub["modo"] == "reemplazo":
+                    conn.execute(text(f'DROP TABLE IF EXISTS "{tabla}"'))
+                    conn.execute(text(f'ALTER TABLE "{stg}" RENAME TO "{tabla}"'))
+
+                else:
+                    borrar_ventana(conn, tabla, pub["desde"], pub.get("hasta"))
+                    columnas = ", ".join(f'"{c}"' for c in pub["columnas"])
+                    conn.execute(text(
+                        f'INSERT INTO "{tabla}" ({columnas}) SELECT {columnas} FROM "{stg}"'
+                    ))
+                    conn.execute(text(f'DROP TABLE "{stg}"'))
+
+            if pd.notna(pub.get("marca")):
+                guardar_marca_agua(conn, tabla, pub["marca"], pub["filas"])
+
+        tablas = [p["tabla"] for p in publicaciones]
+        mantener_indices(conn, tablas)
+        refrescar_agregados(conn, publicaciones)
+        analizar(conn, tablas + [a for a, agg in AGREGADOS.items() if agg["fuente"] in tablas])
+
+    print("Publicadas:", ", ".join(p["tabla"] for p in publicaciones))
+
+
+def rango_fechas(engine, tabla, pub=None):
+    """
+    (MIN, MAX) de fecha que tendrá `tabla` después de publicar `pub`,
+    preguntado a la base (None si no hay fechas). Sin `pub` es el rango de
+    la tabla publicada tal como está.
+    """
+    fuentes = []
+    if pub is not None:
+        fuentes.append(nombre_staging(tabla))
+    if pub is None or pub["modo"] == "ventana":
+        fuentes.append(tabla)
+
+    insp = inspect(engine)
+    minimos, maximos = [], []
+
+    with engine.connect() as conn:
+        for fuente in fuentes:
+            if not insp.has_table(fuente):
+                continue
+            fecha_min, fecha_max = conn.execute(
+                text(f'SELECT MIN(fecha), MAX(fecha) FROM "{fuente}"')
+            ).one()
+            if fecha_min is not None:
+                minimos.append(pd.Timestamp(fecha_min))
+                maximos.append(pd.Timestamp(fecha_max))
+
+    if not minimos:
+        return None
+
+    return min(minimos), max(maximos)
+
+
+def preparar_calendario(rangos, engine):
+    """
+    Deja en staging dim_calendario para cubrir `rangos`. Si solo crece hacia
+    adelante se agregan los días nuevos; si el rango no cambió no se escribe.
+    """
+    rangos = [r for r in rangos if r is not None]
+    if not rangos:
+        print("⚠️ Sin fechas para dim_calendario.")
+        return None
+
+    fecha_min = min(r[0] for r in rangos)
+    fecha_max = max(r[1] for r in rangos)
+
+    actual = rango_fechas(engine, "dim_calendario")
+
+    if actual == (fecha_min, fecha_max):
+        print("dim_calendario: sin cambios de rango.")
+        return None
+
+    if actual is not None and actual[0] == fecha_min and actual[1] < fecha_max:
+        desde = actual[1] + pd.Timedelta(days=1)
+        nuevas = crear_calendario(desde, fecha_max)
+        escribir_tabla(nuevas, nombre_staging("dim_calendario"), engine)
+
+        print(f"dim_calendario: +{len(nuevas)} días desde {desde.date()}")
+
+        return {
+            "tabla": "dim_calendario",
+            "modo": "ventana",
+            "desde": desde,
+            "hasta": None,
+            "columnas": list(nuevas.columns),
+            "filas": len(nuevas),
+        }
+
+    return preparar_reemplazo(crear_calendario(fecha_min, fecha_max), "dim_calendario", engine)
+
+
+# =====================================================
+# PARTICIONES MENSUALES (opcional: ETL_PARTICIONADO=1)
+# =====================================================
+# fact_ventas / fact_items / fact_gastos particionadas por mes de `fecha`:
+# - Postgres: tabla declarativa PARTITION BY RANGE (fecha), una partición
+#   <tabla>_pAAAA_MM por mes; los filtros por fecha podan particiones.
+# - SQLite: una tabla <tabla>_pAAAA_MM por mes y una vista <tabla> con el
+#   UNION ALL de todas (el dashboard y el resto del ETL leen igual).
+# Una carga por ventana vacía y recarga solo los meses que toca; un
+# reemplazo reconstruye todas las particiones desde staging.
+
+PARTICIONABLES = ["fact_ventas", "fact_items", "fact_gastos"]
+
+_PATRON_PARTICION = re.compile(r"_p\d{4}_\d{2}$")
+
+
+def nombre_particion(tabla, mes):
+    return f"{tabla}_p{mes.year}_{mes.month:02d}"
+
+
+def es_particion(nombre):
+    return _PATRON_PARTICION.search(nombre) is not None
+
+
+def es_particionada(conn, tabla):
+    """True si `tabla` usa el layout por mes, False si es tabla común, None si no existe."""
+    if conn.dialect.name == "postgresql":
+        tipo = conn.execute(
+            text("SELECT relkind FROM pg_class WHERE relname = :tabla AND pg_table_is_visible(oid)"),
+            {"tabla": tabla}
+        ).scalar()
+        return None if tipo is None else tipo == "p"
+
+    insp = inspect(conn)
+    if tabla in insp.get_view_names():
+        return True
+    if tabla in insp.get_table_names():
+        return False
+    return None
+
+
+def particiones(conn, tabla):
+    """Particiones existentes de `tabla`, ordenadas por mes."""
+    if conn.dialect.name == "postgresql":
+        nombres = conn.execute(text("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = :tabla
+        """), {"tabla": tabla}).scalars().all()
+    else:
+        nombres = inspect(conn).get_table_names()
+
+    return sorted(n for n in nombres if n.startswith(f"{tabla}_p") and es_particion(n))
+
+
+def tablas_fisicas(conn, tabla):
+    """Tablas donde viven las filas de `tabla` (las particiones en SQLite)."""
+    if conn.dialect.name == "sqlite" and tabla in PARTICIONABLES and es_particionada(conn, tabla):
+        return particiones(conn, tabla)
+    return [tabla]
+
+
+def mes_de_particion(nombre):
+    return pd.Timestamp(f"{nombre[-7:-3]}-{nombre[-2:]}-01")
+
+
+def meses_en(conn, tabla):
+    mes = expresion_mes(conn.dialect.name)
+    valores = conn.execute(text(
+        f'SELECT DISTINCT {mes} FROM "{tabla}" WHERE fecha IS NOT NULL'
+    )).scalars().all()
+    return sorted(pd.Timestamp(v) for v in valores)
+
+
+def crear_como(conn, nueva, modelo):
+    """Tabla vacía `nueva` con las mismas columnas y tipos que `modelo`."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f'CREATE TABLE "{nueva}" (LIKE "{modelo}")'))
+        return
+
+    ddl = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :modelo"),
+        {"modelo": modelo}
+    ).scalar()
+    conn.execute(text(re.sub(r'^CREATE TABLE\s+"?[^"(\s]+"?', f'CREATE TABLE "{nueva}"', ddl)))
+
+
+def crear_particion(conn, tabla, modelo, mes):
+    particion = nombre_particion(tabla, mes)
+
+    if conn.dialect.name == "postgresql":
+        siguiente = mes + pd.offsets.MonthBegin(1)
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{particion}" PARTITION OF "{tabla}" '
+            f"FOR VALUES FROM ('{mes:%Y-%m-%d}') TO ('{siguiente:%Y-%m-%d}')"
+        ))
+    elif not inspect(conn).has_table(particion):
+        crear_como(conn, particion, modelo)
+
+    return particion
+
+
+def crear_estructura(conn, tabla, modelo):
+    """Padre particionado (Postgres); en SQLite la vista se arma al final."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f'CREATE TABLE "{tabla}" (LIKE "{modelo}") PARTITION BY RANGE (fecha)'))
+
+
+def armar_vista(conn, tabla):
+    """SQLite: vista `tabla` = UNION ALL de sus particiones."""
+    if conn.dialect.name != "sqlite":
+        return
+
+    conn.execute(text(f'DROP VIEW IF EXISTS "{tabla}"'))
+    partes = particiones(conn, tabla)
+    if partes:
+        union = " UNION ALL ".join(f'SELECT * FROM "{p}"' for p in partes)
+        conn.execute(text(f'CREATE VIEW "{tabla}" AS {union}'))
+
+
+def eliminar_tabla(conn, tabla):
+    """Borra `tabla` con cualquiera de los dos layouts."""
+    estado = es_particionada(conn, tabla)
+
+    if estado and conn.dialect.name == "sqlite":
+        conn.execute(text(f'DROP VIEW "{tabla}"'))
+        for particion in particiones(conn, tabla):
+            conn.execute(text(f'DROP TABLE "{particion}"'))
+    elif estado is not None:
+        # en Postgres el DROP del padre se lleva las particiones
+        conn.execute(text(f'DROP TABLE "{tabla}"'))
+
+
+def cargar_meses(conn, tabla, origen, columnas, meses, desde=None, hasta=None):
+    """
+    Vacía y recarga desde `origen` la partición de cada mes de `meses`.
+    Con `desde` / `hasta` a mitad de mes, en ese mes solo se reemplaza el
+    tramo de la ventana (igual que borrar_ventana en la tabla única).
+    """
+    lista = ", ".join(f'"{c}"' for c in columnas)
+
+    for mes in meses:
+        particion = crear_particion(conn, tabla, origen, mes)
+        fin = mes + pd.offsets.MonthBegin(1)
+        inicio = max(mes, desde) if desde is not None else mes
+        tope = hasta if hasta is not None and hasta < fin else None
+
+        filtro = "fecha >= :inicio"
+        fechas = [bindparam("inicio", type_=DateTime())]
+        params = {"inicio": inicio.to_pydatetime()}
+        if tope is not None:
+            filtro += " AND fecha <= :hasta"
+            fechas.append(bindparam("hasta", type_=DateTime()))
+            params["hasta"] = tope.to_pydatetime()
+
+        if inicio == mes and tope is None:
+            # la ventana cubre el mes completo
+            vaciar = "TRUNCATE" if conn.dialect.name == "postgresql" else "DELETE FROM"
+            conn.execute(text(f'{vaciar} "{particion}"'))
+        else:
+            conn.execute(text(f'DELETE FROM "{particion}" WHERE {filtro}').bindparams(*fechas), params)
+
+        conn.execute(
+            text(
+                f'INSERT INTO "{particion}" ({lista}) SELECT {lista} FROM "{origen}" '
+                f"WHERE {filtro} AND fecha < :fin"
+            ).bindparams(*fechas, bindparam("fin", type_=DateTime())),
+            {**params, "fin": fin.to_pydatetime()}
+        )
+
+
+def publicar_particionada(conn, pub):
+    """Publica `pub` (stg_<tabla>) en el layout por mes, dentro de `conn`."""
+    tabla = pub["tabla"]
+    stg = nombre_staging(tabla)
+    columnas = pub.get("columnas") or [c["name"] for c in inspect(conn).get_columns(stg)]
+    estado = es_particionada(conn, tabla)
+
+    if pub["modo"] == "reemplazo" or estado is None:
+        eliminar_tabla(conn, tabla)
+        crear_estructura(conn, tabla, stg)
+        cargar_meses(conn, tabla, stg, columnas, meses_en(conn, stg))
+
+    else:
+        if estado is False:
+            # tabla común de una carga anterior: se reparte por mes una vez
+            previa = f"{tabla}__previa"
+            conn.execute(text(f'ALTER TABLE "{tabla}" RENAME TO "{previa}"'))
+            crear_estructura(conn, tabla, previa)
+            cargar_meses(conn, tabla, previa, columnas, meses_en(conn, previa))
+            conn.execute(text(f'DROP TABLE "{previa}"'))
+            print(f"{tabla}: convertida a particiones mensuales.")
+
+        # meses de la ventana: los que trae staging y los ya cargados dentro de ella
+        desde = pub["desde"]
+        hasta = None if pd.isna(pub.get("hasta")) else pub["hasta"]
+        primer_mes = desde.to_period("M").to_timestamp()
+        cargados = [
+            m for m in map(mes_de_particion, particiones(conn, tabla))
+            if m >= primer_mes and (hasta is None or m <= hasta)
+        ]
+        meses = sorted(set(meses_en(conn, stg)) | set(cargados))
+        cargar_meses(conn, tabla, stg, columnas, meses, desde=desde, hasta=hasta)
+
+    conn.execute(text(f'DROP TABLE "{stg}"'))
+    armar_vista(conn, tabla)
+
+
+def desparticionar(conn, tabla, conservar=True):
+    """Vuelve `tabla` a tabla única (copiando sus filas si `conservar`)."""
+    if conservar:
+        previa = f"{tabla}__previa"
+        modelo = particiones(conn, tabla)[0] if conn.dialect.name == "sqlite" else tabla
+        crear_como(conn, previa, modelo)
+        conn.execute(text(f'INSERT INTO "{previa}" SELECT * FROM "{tabla}"'))
+        eliminar_tabla(conn, tabla)
+        conn.execute(text(f'ALTER TABLE "{previa}" RENAME TO "{tabla}"'))
+    else:
+        eliminar_tabla(conn, tabla)
+
+    print(f"{tabla}: vuelve a tabla única.")
+
+
+# =====================================================
+# ÍNDICES Y ESTADÍSTICAS
+# =====================================================
+# to_sql crea las tablas sin índices. Se crean después del swap (dentro de
+# publicar): los nombres de índice son globales, así que no pueden nacer en
+# stg_* mientras la tabla vieja todavía tiene los suyos. En modo ventana la
+# tabla ya los tiene y IF NOT EXISTS no hace nada.
+
+INDICES = {
+    "fact_ventas": [["fecha"]],
+    "fact_gastos": [["fecha"], ["clasificacion"]],
+    # (fecha, seccion) también sirve a los filtros solo por fecha
+    "fact_items": [["fecha", "seccion"], ["seccion"], ["item"]],
+    "dim_calendario": [["fecha"]],
+    "dim_costos_unitarios": [["item"]],
+}
+
+
+def nombre_indice(tabla, columnas):
+    return f"ix_{tabla}_{'_'.join(columnas)}"
+
+
+def mantener_indices(conn, tablas):
+    for tabla in tablas:
+        for columnas in INDICES.get(tabla, []):
+            lista = ", ".join(f'"{c}"' for c in columnas)
+            # en Postgres el índice del padre se propaga a cada partición
+            for fisica in tablas_fisicas(conn, tabla):
+                conn.execute(text(
+                    f'CREATE INDEX IF NOT EXISTS "{nombre_indice(fisica, columnas)}" ON "{fisica}" ({lista})'
+                ))
+
+
+def analizar(conn, tablas):
+    """ANALYZE de las tablas recién cargadas (estadísticas para el planner)."""
+    for tabla in tablas:
+        for fisica in tablas_fisicas(conn, tabla):
+            conn.execute(text(f'ANALYZE "{fisica}"'))
+
+
+# =====================================================
+# AGREGADOS MENSUALES (agg_*)
+# =====================================================
+# Totales por mes que usa casi todo el dashboard. Se calculan en la base
+# desde las fact ya publicadas, dentro de la misma transacción de publicar:
+# con reemplazo se reconstruyen completos; con ventana solo se recalculan
+# los meses que toca la ventana.
+
+AGREGADOS = {
+    "agg_ventas_mes": {
+        "fuente": "fact_ventas",
+        "claves": [],
+        "medidas": {
+            "total": ("SUM", "total"),
+            "transacciones": ("COUNT", None),
+            "descuento": ("SUM", "descuento_al_total"),
+            "propina": ("SUM", "total_propina"),
+        },
+    },
+    "agg_gastos_mes_clasificacion": {
+        "fuente": "fact_gastos",
+        "claves": ["clasificacion", "tipo", "grupo_1", "grupo_2"],
+        "medidas": {
+            "total": ("SUM", "total"),
+            "registros": ("COUNT", None),
+        },
+    },
+    "agg_items_mes_seccion": {
+        "fuente": "fact_items",
+        "claves": ["seccion"],
+        "medidas": {
+            "total": ("SUM", "precio"),
+            "items": ("COUNT", None),
+        },
+    },
+}
+
+
+def expresion_mes(dialecto):
+    """Primer día del mes de `fecha`, como DATE."""
+    if dialecto == "sqlite":
+        return "date(fecha, 'start of month')"
+    return "CAST(date_trunc('month', fecha) AS DATE)"
+
+
+def medidas_disponibles(agg, columnas):
+    """
+    {nombre: expresión SQL} de las medidas de `agg` cuya columna existe en la
+    fact. Un export sin descuento / propina no debe tumbar la publicación.
+    """
+    return {
+        nombre: f'{funcion}("{columna}")' if columna else f"{funcion}(*)"
+        for nombre, (funcion, columna) in agg["medidas"].items()
+        if columna is None or columna in columnas
+    }
+
+
+def consulta_agregado(agg, dialecto, medidas, filtro_fecha=""):
+    claves = "".join(f', "{c}"' for c in agg["claves"])
+    medidas = ", ".join(f'{expr} AS "{nombre}"' for nombre, expr in medidas.items())
+    mes = expresion_mes(dialecto)
+
+    return (
+        f"SELECT {mes} AS mes{claves}, {medidas} "
+        f'FROM "{agg["fuente"]}" WHERE fecha IS NOT NULL{filtro_fecha} '
+        f"GROUP BY {mes}{claves}"
+    )
+
+
+def meses_de_ventana(pub):
+    """[desde, hasta) en meses completos que toca una publicación por ventana."""
+    desde = pub["desde"].to_period("M").to_timestamp()
+    hasta = pub.get("hasta")
+    if hasta is None or pd.isna(hasta):
+        return desde, None
+    return desde, (hasta.to_period("M") + 1).to_timestamp()
+
+
+def refrescar_agregados(conn, publicaciones):
+    """Recalcula los agg_* cuya fact se está publicando (en `conn`)."""
+    dialecto = conn.dialect.name
+    por_tabla = {p["tabla"]: p for p in publicaciones}
+    refrescados = []
+
+    for nombre, agg in AGREGADOS.items():
+        pub = por_tabla.get(agg["fuente"])
+        if pub is None:
+            continue
+
+        columnas = {c["name"] for c in inspect(conn).get_columns(agg["fuente"])}
+        medidas = medidas_disponibles(agg, columnas)
+
+        if pub["modo"] == "ventana" and inspect(conn).has_table(nombre):
+            desde, hasta = meses_de_ventana(pub)
+
+            borrar = text(f'DELETE FROM "{nombre}" WHERE mes >= :desde').bindparams(
+                bindparam("desde", type_=sqltypes.Date())
+            )
+            filtro = " AND fecha >= :desde"
+            params_mes = {"desde": desde.date()}
+            params = {"desde": desde.to_pydatetime()}
+
+            if hasta is not None:
+                borrar = text(f'DELETE FROM "{nombre}" WHERE mes >= :desde AND mes < :hasta').bindparams(
+                    bindparam("desde", type_=sqltypes.Date()),
+                    bindparam("hasta", type_=sqltypes.Date()),
+                )
+                filtro += " AND fecha < :hasta"
+                params_mes["hasta"] = hasta.date()
+                params["hasta"] = hasta.to_pydatetime()
+
+            destino = ", ".join(f'"{c}"' for c in ["mes", *agg["claves"], *medidas])
+            insertar = text(
+                f'INSERT INTO "{nombre}" ({destino}) {consulta_agregado(agg, dialecto, medidas, filtro)}'
+            ).bindparams(
+                *[bindparam(k, type_=DateTime()) for k in params]
+            )
+            conn.execute(borrar, params_mes)
+            conn.execute(insertar, params)
+
+        else:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{nombre}"'))
+            conn.execute(text(f'CREATE TABLE "{nombre}" AS {consulta_agregado(agg, dialecto, medidas)}'))
+
+        refrescados.append(nombre)
+
+    if refrescados:
+        print("Agregados:", ", ".join(refrescados))
+
+
+# =====================================================
+# MANIFIESTO DE ARCHIVOS (SHA-256 + versión ETL)
+# =====================================================
+# Si el usuario vuelve a subir el mismo archivo y el ETL no cambió,
+# la etapa se omite. Subir ETL_VERSION obliga a reprocesar todo. Cada
+# entrada recuerda en qué base se cargó: otra DATABASE_URL, o la misma
+# base sin las tablas de la etapa (reseteada), vuelve a procesar.
+
+ETL_VERSION = "4"
+
+RUTA_MANIFIESTO = os.path.join(UPLOADS_DIR, "manifest_etl.json")
+
+
+def hash_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def leer_manifiesto():
+    try:
+        with open(RUTA_MANIFIESTO, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def guardar_manifiesto(manifiesto):
+    os.makedirs(os.path.dirname(RUTA_MANIFIESTO), exist_ok=True)
+    tmp = RUTA_MANIFIESTO + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=2)
+    os.replace(tmp, RUTA_MANIFIESTO)
+
+
+# tablas que publica cada etapa (dim_calendario depende de gastos y ventas)
+TABLAS_POR_ETAPA = {
+    "gastos": ["fact_gastos"],
+    "ventas": ["fact_ventas", "fact_items", "dim_secciones"],
+    "costos": ["dim_costos_unitarios"],
+}
+
+
+def identidad_destino(engine):
+    """Huella de la base de destino (URL sin contraseña), para el manifiesto."""
+    url = engine.url.render_as_string(hide_password=True)
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+
+
+def tablas_de_etapa_presentes(engine, etapa):
+    insp = inspect(engine)
+    return all(insp.has_table(tabla) for tabla in TABLAS_POR_ETAPA.get(etapa, []))
+
+
+def etapa_sin_cambios(manifiesto, etapa, sha256, destino=None):
+    previo = manifiesto.get(etapa) or {}
+    return (
+        sha256 is not None
+        and previo.get("sha256") == sha256
+        and previo.get("etl_version") == ETL_VERSION
+        and previo.get("destino") == destino
+    )
+
+
+def registrar_etapa(manifiesto, etapa, ruta, sha256, destino=None):
+    if sha256 is None:
+        return
+    manifiesto[etapa] = {
+        "archivo": os.path.basename(ruta),
+        "sha256": sha256,
+        "etl_version": ETL_VERSION,
+        "destino": destino,
+        "procesado": pd.Timestamp.now().isoformat(timespec="seconds"),
+    }
+    guardar_manifiesto(manifiesto)
+
+
+# =====================================================
+# PLAN DE CORRIDA
+# =====================================================
+
+def planificar_etl(
+    run_gastos=True, run_ventas=True, run_costos=True, forzar=False, manifiesto=None, engine=None
+):
+    """
+    Resuelve las fuentes en este momento y decide qué etapas correr:
+    {"fuentes": {etapa: {"ruta", "sha256"}}, "etapas": [...], "omitidas": [...]}
+    Con `engine`, una etapa solo se omite si se cargó en esa misma base y
+    sus tablas siguen ahí.
+    """
+    if manifiesto is None:
+        manifiesto = leer_manifiesto()
+
+    destino = identidad_destino(engine) if engine is not None else None
+
+    fuentes = buscar_fuentes()
+    pedidas = {"gastos": run_gastos, "ventas": run_ventas, "costos": run_costos}
+
+    plan = {"fuentes": {}, "etapas": [], "omitidas": []}
+
+    for etapa, pedida in pedidas.items():
+        if not pedida:
+            continue
+
+        ruta = fuentes[etapa]
+        sha256 = hash_archivo(ruta) if ruta else None
+        plan["fuentes"][etapa] = {"ruta": ruta, "sha256": sha256}
+
+        if (
+            not forzar
+            and etapa_sin_cambios(manifiesto, etapa, sha256, destino)
+            and (engine is None or tablas_de_etapa_presentes(engine, etapa))
+        ):
+            plan["omitidas"].append(etapa)
+        else:
+            plan["etapas"].append(etapa)
+
+    return plan
+
+
+# =====================================================
+# CACHE PARQUET (salida limpia por hash de archivo)
+# =====================================================
+# La salida de cada procesar_* se guarda junto a uploads/ con el hash del
+# archivo fuente. Si el archivo no cambió se relee el parquet en vez de
+# volver a parsear el Excel. Requiere pyarrow; sin él la cache se desactiva.
+
+CACHE_DIR = os.path.join(UPLOADS_DIR, "cache")
+
+
+def ruta_cache(nombre, sha256):
+    return os.path.join(CACHE_DIR, f"{nombre}_{sha256[:16]}_v{ETL_VERSION}.parquet")
+
+
+def leer_cache(nombre, sha256):
+    if sha256 is None:
+        return None
+
+    ruta = ruta_cache(nombre, sha256)
+    if not os.path.exists(ruta):
+        return None
+
+    try:
+        return pd.read_parquet(ruta)
+    except Exception as e:
+        print(f"⚠️ Cache {nombre} ilegible, se reprocesa: {e}")
+        return None
+
+
+def guardar_cache(nombre, sha256, df):
+    if sha256 is None:
+        return
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    ruta = ruta_cache(nombre, sha256)
+
+    try:
+        df.to_parquet(ruta, index=False)
+    except Exception as e:
+        # típicamente falta pyarrow
+        print(f"⚠️ No se pudo guardar cache {nombre}: {e}")
+        return
+
+    # solo se conserva la versión vigente de cada fuente
+    for archivo in os.listdir(CACHE_DIR):
+        otra = os.path.join(CACHE_DIR, archivo)
+        if archivo.startswith(f"{nombre}_") and otra != ruta:
+            os.remove(otra)
+
+
+def con_cache(nombre, sha256, procesar):
+    """Devuelve la salida cacheada de `procesar` o la calcula y la guarda."""
+    df = leer_cache(nombre, sha256)
+
+    if df is not None:
+        print(f"{nombre}: cargado desde cache.")
+        return df
+
+    df = procesar()
+    guardar_cache(nombre, sha256, df)
+    return df
+
+
+# =====================================================
+# TELEMETRÍA (tiempo, CPU, memoria y filas por etapa)
+# =====================================================
+
+TABLA_CORRIDAS = "etl_runs"
+TABLA_METRICAS = "etl_stage_metrics"
+
+COLUMNAS_METRICAS = [
+    "etapa", "segundos", "cpu_segundos", "pico_mb",
+    "filas_leidas", "filas_descartadas", "filas_escritas",
+]
+
+
+def reiniciar_pico_memoria():
+    """
+    Vuelve a cero el pico de RSS del proceso (VmHWM) para que el próximo
+    pico_memoria_mb() mida solo la etapa. Solo Linux; False si no se pudo.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def pico_memoria_mb():
+    """Pico de RSS (VmHWM) desde el último reinicio, en MB (None fuera de Linux)."""
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return round(int(linea.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+@contextmanager
+def medir_etapa(metricas, etapa):
+    """Agrega a `metricas` un dict con tiempos, pico de memoria y filas de la etapa."""
+    m = {c: None for c in COLUMNAS_METRICAS}
+    m["etapa"] = etapa
+
+    # sin reinicio, VmHWM / ru_maxrss es el pico de toda la vida del proceso
+    por_etapa = reiniciar_pico_memoria()
+
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    try:
+        yield m
+    finally:
+        m["segundos"] = round(time.perf_counter() - t0, 3)
+        m["cpu_segundos"] = round(time.process_time() - c0, 3)
+        m["pico_mb"] = pico_memoria_mb() if por_etapa else None
+        metricas.append(m)
+
+
+def filas_de(*frames):
+    """(leídas, descartadas) sumando lo anotado por con_conteo."""
+    leidas = sum(df.attrs.get("filas_leidas", len(df)) for df in frames)
+    descartadas = sum(df.attrs.get("filas_descartadas", 0) for df in frames)
+    return leidas, descartadas
+
+
+def guardar_metricas(engine, corrida):
+    """Persiste la corrida en etl_runs / etl_stage_metrics (no corta el ETL)."""
+    fila = {k: v for k, v in corrida.items() if k != "etapas"}
+    df_corrida = pd.DataFrame([fila])
+
+    df_etapas = pd.DataFrame(corrida["etapas"], columns=COLUMNAS_METRICAS)
+    numericas = COLUMNAS_METRICAS[1:]
+    df_etapas[numericas] = df_etapas[numericas].astype("float64")
+    df_etapas.insert(0, "run_id", corrida["run_id"])
+
+    try:
+        with engine.begin() as conn:
+            escribir_tabla(df_corrida, TABLA_CORRIDAS, conn, if_exists="append")
+            escribir_tabla(df_etapas, TABLA_METRICAS, conn, if_exists="append")
+    except Exception as e:
+        print(f"⚠️ No se pudieron guardar métricas ETL: {e}")
+
+
+def resumen_corrida(corrida):
+    for m in corrida["etapas"]:
+        print(
+            f"  {m['etapa']:<32} {m['segundos']:>8.2f}s  cpu {m['cpu_segundos']:>7.2f}s"
+            f"  leídas {m['filas_leidas']}  descartadas {m['filas_descartadas']}"
+            f"  escritas {m['filas_escritas']}"
+        )
+    print(f"ETL {corrida['segundos']:.2f}s, etapa dominante: {corrida['etapa_dominante']}")
+
+
+# =====================================================
+# ETAPAS EN PARALELO (procesos)
+# =====================================================
+# Gastos, ventas y costo unitario no dependen entre sí hasta el calendario.
+# Parsear Excel es CPU y retiene el GIL, así que cada fuente va a un proceso.
+
+def etapa_gastos(ruta, sha256):
+    return con_cache("gastos", sha256, lambda: procesar_gastos(ruta))
+
+
+def etapa_ventas(ruta, sha256):
+    """(transacciones, items, secciones) desde cache o desde el libro."""
+    df_ventas = leer_cache("transacciones", sha256)
+    df_items = leer_cache("items", sha256)
+    df_secciones = leer_cache("secciones", sha256)
+
+    if df_ventas is not None and df_items is not None and df_secciones is not None:
+        print("Ventas: cargado desde cache.")
+        return df_ventas, df_items, df_secciones
+
+    print("Leyendo libro de ventas...")
+    hojas = leer_libro_ventas(ruta)
+
+    print("Procesando Transacciones...")
+    df_ventas = procesar_transacciones(hojas["Transacciones"])
+
+    print("Procesando Items...")
+    df_items = procesar_items(hojas["Items"])
+
+    print("Procesando Secciones...")
+    df_secciones = procesar_secciones(hojas["Secciones"])
+
+    guardar_cache("transacciones", sha256, df_ventas)
+    guardar_cache("items", sha256, df_items)
+    guardar_cache("secciones", sha256, df_secciones)
+
+    return df_ventas, df_items, df_secciones
+
+
+def etapa_costos(ruta, sha256):
+    return con_cache("costo_unitario", sha256, lambda: procesar_costo_unitario(ruta))
+
+
+def ejecutar_medido(etapa, funcion, args):
+    """Corre una etapa de parseo y devuelve (resultado, métricas)."""
+    metricas = []
+    with medir_etapa(metricas, etapa) as m:
+        resultado = funcion(*args)
+        frames = resultado if isinstance(resultado, tuple) else (resultado,)
+        m["filas_leidas"], m["filas_descartadas"] = filas_de(*frames)
+    return resultado, metricas[0]
+
+
+def contexto_pool():
+    """
+    Hijos sin fork: el ETL también corre dentro del servidor de Streamlit,
+    que tiene varios hilos, y hacer fork de un proceso con hilos puede dejar
+    a los hijos trabados en un lock (Python 3.12+ lo advierte).
+    """
+    metodos = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in metodos else "spawn")
+
+
+def ejecutar_etapas(tareas, paralelo=False, metricas=None):
+    """
+    tareas: {nombre: (funcion, args)}. Devuelve {nombre: resultado} y, si
+    se pasa `metricas`, le agrega lo medido en cada etapa.
+    Con `paralelo` y más de una tarea usa un pool de procesos; si el pool no
+    se puede usar (entorno sin multiprocessing) se corre en serie.
+    """
+    salidas = None
+
+    if paralelo and len(tareas) > 1:
+        try:
+            workers = min(len(tareas), os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=contexto_pool()) as pool:
+                futuros = {
+                    nombre: pool.submit(ejecutar_medido, nombre, funcion, args)
+                    for nombre, (funcion, args) in tareas.items()
+                }
+                salidas = {nombre: futuro.result() for nombre, futuro in futuros.items()}
+
+        except (BrokenProcessPool, NotImplementedError, PermissionError) as e:
+            print(f"⚠️ Pool de procesos no disponible ({e}), se procesa en serie.")
+
+    if salidas is None:
+        salidas = {
+            nombre: ejecutar_medido(nombre, funcion, args)
+            for nombre, (funcion, args) in tareas.items()
+        }
+
+    if metricas is not None:
+        metricas.extend(m for _, m in salidas.values())
+
+    return {nombre: resultado for nombre, (resultado, _) in salidas.items()}
 
 
 # =====================================================
@@ -520,41 +1975,129 @@ def crear_calendario(df_ventas, df_gastos):
 
 import argparse
 
-def main(run_gastos: bool = True, run_ventas: bool = True, run_costos: bool = True):
+def main(
+    run_gastos: bool = True,
+    run_ventas: bool = True,
+    run_costos: bool = True,
+    incremental: bool = True,
+    streaming: bool = None,
+    forzar: bool = False,
+    paralelo: bool = None,
+    particionado: bool = None
+):
+
+    # streaming: lee Transacciones / Items por bloques (memoria constante)
+    if streaming is None:
+        streaming = os.environ.get("ETL_STREAMING") == "1"
+
+    # paralelo: cada fuente se parsea en su propio proceso. Solo a pedido:
+    # cada worker suma su propia memoria y el pico pasa el techo de Render
+    if paralelo is None:
+        paralelo = os.environ.get("ETL_PARALELO") == "1"
+
+    # particionado: fact_* por mes (ver PARTICIONES MENSUALES)
+    if particionado is None:
+        particionado = os.environ.get("ETL_PARTICIONADO") == "1"
+
+    inicio = pd.Timestamp.now()
+    t0 = time.perf_counter()
+    metricas = []
 
+    # -------------------------
+    # PLAN: fuentes de esta corrida + etapas sin cambios (manifiesto)
+    # -------------------------
     print("Conectando a PostgreSQL (Neon)...")
     DATABASE_URL = os.environ["DATABASE_URL"]
-    engine = create_engine(DATABASE_URL)
+    engine = crear_engine(DATABASE_URL)
+
+    manifiesto = leer_manifiesto()
+    plan = planificar_etl(
+        run_gastos, run_ventas, run_costos, forzar=forzar, manifiesto=manifiesto, engine=engine
+    )
+
+    for etapa, fuente in plan["fuentes"].items():
+        print(f"Fuente {etapa}: {fuente['ruta'] or '(no encontrada)'}")
+    for etapa in plan["omitidas"]:
+        print(f"{etapa}: archivo sin cambios, se omite.")
 
-    df_gastos = None
-    df_ventas = None
-    df_items = None
-    df_secciones = None
+    rutas = {etapa: f["ruta"] for etapa, f in plan["fuentes"].items()}
+    hashes = {etapa: f["sha256"] for etapa, f in plan["fuentes"].items()}
+
+    run_gastos = "gastos" in plan["etapas"]
+    run_ventas = "ventas" in plan["etapas"]
+    run_costos = "costos" in plan["etapas"]
+
+    if not plan["etapas"]:
+        print("ETL: nada que procesar.")
+        return {"ejecutadas": [], "omitidas": plan["omitidas"], "plan": plan, "metricas": None}
+
+    # -------------------------
+    # PARSEO DE FUENTES (independientes entre sí)
+    # -------------------------
+    tareas = {}
+    if run_gastos:
+        tareas["gastos"] = (etapa_gastos, (rutas["gastos"], hashes["gastos"]))
+    if run_ventas and not streaming:
+        tareas["ventas"] = (etapa_ventas, (rutas["ventas"], hashes["ventas"]))
+    if run_costos:
+        tareas["costos"] = (etapa_costos, (rutas["costos"], hashes["costos"]))
+
+    print("Procesando fuentes:", ", ".join(tareas) or "-")
+    resultados = ejecutar_etapas(tareas, paralelo=paralelo, metricas=metricas)
+
+    df_gastos = resultados.get("gastos")
+
+    # todo se escribe en staging; se publica junto al final
+    publicaciones = {}
+
+    def a_staging(tabla, preparar, *args, **kwargs):
+        with medir_etapa(metricas, f"escritura {tabla}") as m:
+            pub = preparar(*args, **kwargs)
+            if pub is not None:
+                m["filas_escritas"] = pub["filas"]
+                m["filas_leidas"] = pub.get("filas_leidas")
+                m["filas_descartadas"] = pub.get("filas_descartadas")
+                if tabla in PARTICIONABLES:
+                    pub["particionado"] = particionado
+        publicaciones[tabla] = pub
 
     # -------------------------
     # GASTOS
     # -------------------------
     if run_gastos:
-        print("Procesando Gastos...")
-        df_gastos = procesar_gastos()
-        df_gastos.to_sql("fact_gastos", engine, if_exists="replace", index=False)
+        a_staging("fact_gastos", preparar_reemplazo, df_gastos, "fact_gastos", engine)
 
     # -------------------------
     # VENTAS / ITEMS / SECCIONES
     # -------------------------
-    if run_ventas:
-        print("Procesando Transacciones...")
-        df_ventas = procesar_transacciones()
-
-        print("Procesando Items...")
-        df_items = procesar_items()
+    if run_ventas and streaming:
+        if rutas["ventas"] is None:
+            raise FileNotFoundError("No se encontró archivo de ventas.")
+
+        print("Procesando Transacciones (streaming)...")
+        a_staging(
+            "fact_ventas", preparar_streaming,
+            iterar_hoja_por_bloques(rutas["ventas"], "Transacciones"),
+            procesar_transacciones, "fact_ventas", engine, incremental=incremental
+        )
+
+        print("Procesando Items (streaming)...")
+        a_staging(
+            "fact_items", preparar_streaming,
+            iterar_hoja_por_bloques(rutas["ventas"], "Items"),
+            procesar_items, "fact_items", engine, incremental=incremental
+        )
 
         print("Procesando Secciones...")
-        df_secciones = procesar_secciones()
+        df_secciones = procesar_secciones(ruta=rutas["ventas"])
+        a_staging("dim_secciones", preparar_reemplazo, df_secciones, "dim_secciones", engine)
+
+    elif run_ventas:
+        df_ventas, df_items, df_secciones = resultados["ventas"]
 
-        df_ventas.to_sql("fact_ventas", engine, if_exists="replace", index=False)
-        df_items.to_sql("fact_items", engine, if_exists="replace", index=False)
-        df_secciones.to_sql("dim_secciones", engine, if_exists="replace", index=False)
+        a_staging("fact_ventas", preparar_incremental, df_ventas, "fact_ventas", engine, incremental=incremental)
+        a_staging("fact_items", preparar_incremental, df_items, "fact_items", engine, incremental=incremental)
+        a_staging("dim_secciones", preparar_reemplazo, df_secciones, "dim_secciones", engine)
 
     # -------------------------
     # CALENDARIO (si cambió ventas o gastos)
@@ -562,39 +2105,71 @@ def main(run_gastos: bool = True, run_ventas: bool = True, run_costos: bool = Tr
     if run_ventas or run_gastos:
         print("Creando Calendario...")
 
-        if df_ventas is None:
-            df_ventas = pd.read_sql("SELECT * FROM fact_ventas", engine)
-            if "fecha" in df_ventas.columns:
-                df_ventas["fecha"] = pd.to_datetime(df_ventas["fecha"], errors="coerce")
+        # rango de fechas en la base (MIN / MAX), sin leer las fact de vuelta
+        with medir_etapa(metricas, "calendario"):
+            rangos = [
+                rango_fechas(engine, "fact_ventas", publicaciones.get("fact_ventas")),
+                rango_fechas(engine, "fact_gastos", publicaciones.get("fact_gastos")),
+            ]
 
-        if df_gastos is None:
-            df_gastos = pd.read_sql("SELECT * FROM fact_gastos", engine)
-            if "fecha" in df_gastos.columns:
-                df_gastos["fecha"] = pd.to_datetime(df_gastos["fecha"], errors="coerce")
-
-        df_calendario = crear_calendario(df_ventas, df_gastos)
-        df_calendario.to_sql("dim_calendario", engine, if_exists="replace", index=False)
+        a_staging("dim_calendario", preparar_calendario, rangos, engine)
 
     # -------------------------
     # COSTO UNITARIO (cliente)
     # -------------------------
     if run_costos:
-        print("Procesando Costo Unitario (cliente)...")
-
-        df_costo_unitario = procesar_costo_unitario()
+        df_costo_unitario = resultados["costos"]
 
         if not df_costo_unitario.empty:
-            df_costo_unitario.to_sql(
-                "dim_costos_unitarios",
-                engine,
-                if_exists="replace",
-                index=False
+            a_staging(
+                "dim_costos_unitarios", preparar_reemplazo,
+                df_costo_unitario, "dim_costos_unitarios", engine
             )
         else:
             print("⚠️ No se generó dim_costos_unitarios.")
 
+    # -------------------------
+    # PUBLICACIÓN (una transacción)
+    # -------------------------
+    with medir_etapa(metricas, "publicacion") as m:
+        publicar(engine, publicaciones.values())
+        m["filas_escritas"] = sum(p["filas"] for p in publicaciones.values() if p)
+
+    destino = identidad_destino(engine)
+    if run_gastos:
+        registrar_etapa(manifiesto, "gastos", rutas["gastos"], hashes["gastos"], destino)
+    if run_ventas:
+        registrar_etapa(manifiesto, "ventas", rutas["ventas"], hashes["ventas"], destino)
+    if run_costos:
+        registrar_etapa(manifiesto, "costos", rutas["costos"], hashes["costos"], destino)
+
+    # -------------------------
+    # TELEMETRÍA
+    # -------------------------
+    dominante = max(metricas, key=lambda m: m["segundos"]) if metricas else None
+    corrida = {
+        "run_id": uuid.uuid4().hex[:12],
+        "inicio": inicio,
+        "fin": pd.Timestamp.now(),
+        "segundos": round(time.perf_counter() - t0, 3),
+        "etapas": metricas,
+        "ejecutadas": ",".join(plan["etapas"]),
+        "omitidas": ",".join(plan["omitidas"]),
+        "etapa_dominante": dominante["etapa"] if dominante else None,
+        "etl_version": ETL_VERSION,
+    }
+    resumen_corrida(corrida)
+    guardar_metricas(engine, corrida)
+
     print("ETL COMPLETADO CORRECTAMENTE.")
 
+    return {
+        "ejecutadas": plan["etapas"],
+        "omitidas": plan["omitidas"],
+        "plan": plan,
+        "metricas": corrida,
+    }
+
 
 def run_etl():
     # modo clásico: corre todo
@@ -606,11 +2181,33 @@ if __name__ == "__main__":
     parser.add_argument("--ventas", action="store_true")
     parser.add_argument("--gastos", action="store_true")
     parser.add_argument("--costos", action="store_true")
+    parser.add_argument("--completo", action="store_true", help="reemplaza ventas/items completos")
+    parser.add_argument("--streaming", action="store_true", help="lee ventas por bloques")
+    parser.add_argument("--forzar", action="store_true", help="reprocesa aunque el archivo no cambie")
+    parser.add_argument("--paralelo", action="store_true", help="parsea cada fuente en su propio proceso")
+    parser.add_argument("--serial", action="store_true", help="no usa procesos en paralelo")
+    parser.add_argument("--particionado", action="store_true", help="fact_* particionadas por mes")
     args = parser.parse_args()
 
     # si no pasan flags, corre todo
     if not (args.ventas or args.gastos or args.costos):
-        main(True, True, True)
+        main(
+            True, True, True,
+            incremental=not args.completo,
+            streaming=args.streaming or None,
+            forzar=args.forzar,
+            paralelo=False if args.serial else (args.paralelo or None),
+            particionado=args.particionado or None
+        )
     else:
-        main(run_gastos=args.gastos, run_ventas=args.ventas, run_costos=args.costos)
+        main(
+            run_gastos=args.gastos,
+            run_ventas=args.ventas,
+            run_costos=args.costos,
+            incremental=not args.completo,
+            streaming=args.streaming or None,
+            forzar=args.forzar,
+            paralelo=False if args.serial else (args.paralelo or None),
+            particionado=args.particionado or None
+        )
     
@@ -1,25 +1,477 @@
 import os
+import re
 import sqlite3
+import hashlib
+import queue
+import datetime
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 import pandas as pd
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine, event, inspect, text, bindparam, DateTime
+from sqlalchemy.sql import sqltypes
 
 
-def main():
-    database_url = os.environ.get("DATABASE_URL")
+# =====================================================
+# HUELLAS (qué cambió desde el último sync)
+# =====================================================
+# Por cada tabla se calcula en Postgres una huella: filas, MAX(fecha) y un
+# hash del contenido. Las tablas con `fecha` se huellan por mes. La réplica
+# guarda la última huella copiada en sync_huellas; solo se copia lo que
+# cambió (tabla completa, o los meses distintos de una fact).
+
+TABLA_HUELLAS = "sync_huellas"
+TABLA_COMPLETA = "*"
+SIN_FECHA = "sin_fecha"
+
+
+def es_particion(tabla, padre=None):
+    if padre is None:
+        return re.search(r"_p\d{4}_\d{2}$", tabla) is not None
+    return re.fullmatch(rf"{re.escape(padre)}_p\d{{4}}_\d{{2}}", tabla) is not None
+
+
+def listar_tablas(inspector):
+    # stg_*: tablas de staging del ETL (a medio cargar), no se replican
+    # <tabla>_pAAAA_MM: particiones mensuales; sus filas ya vienen en la tabla padre
+    nombres = inspector.get_table_names() + inspector.get_view_names()
+    return [t for t in nombres if not t.startswith("stg_") and not es_particion(t)]
+
+
+def expresion_mes(dialecto):
+    if dialecto == "sqlite":
+        return "date(fecha, 'start of month')"
+    return "CAST(date_trunc('month', fecha) AS DATE)"
+
+
+def huella_fila(*valores):
+    """Hash de 48 bits de una fila (origen SQLite, que no trae md5)."""
+    return int(hashlib.md5(repr(valores).encode("utf-8")).hexdigest()[:12], 16)
+
+
+def crear_engine_origen(database_url):
+    engine = create_engine(database_url)
+
+    if engine.dialect.name == "sqlite":
+
+        @event.listens_for(engine, "connect")
+        def _registrar_huella(dbapi_conn, connection_record):
+            dbapi_conn.create_function("huella_fila", -1, huella_fila, deterministic=True)
+
+    return engine
+
+
+def expresion_huella(dialecto, columnas):
+    """Hash agregado (independiente del orden) del contenido de las filas del grupo."""
+    if dialecto == "postgresql":
+        return "md5(string_agg(md5(t::text), '' ORDER BY md5(t::text)))"
+
+    lista = ", ".join(f'"{c["name"]}"' for c in columnas)
+    return f"TOTAL(huella_fila({lista}))"
+
+
+def huellas_origen(engine, tabla, columnas):
+    """{mes: (filas, fecha_max, huella)}; mes = TABLA_COMPLETA si no hay fecha."""
+    dialecto = engine.dialect.name
+    huella = expresion_huella(dialecto, columnas)
+    por_mes = any(c["name"] == "fecha" for c in columnas)
+
+    if por_mes:
+        mes = expresion_mes(dialecto)
+        consulta = (
+            f"SELECT {mes} AS mes, COUNT(*), MAX(fecha), {huella} "
+            f'FROM "{tabla}" t GROUP BY {mes}'
+        )
+    else:
+        consulta = f'SELECT NULL AS mes, COUNT(*), NULL, {huella} FROM "{tabla}" t'
+
+    with engine.connect() as conn:
+        filas = conn.execute(text(consulta)).all()
+
+    huellas = {}
+    for mes, n, fecha_max, valor in filas:
+        if not por_mes:
+            clave = TABLA_COMPLETA
+        elif mes is None:
+            clave = SIN_FECHA
+        else:
+            clave = pd.Timestamp(mes).strftime("%Y-%m-%d")
+
+        if n:
+            huellas[clave] = (int(n), None if fecha_max is None else str(fecha_max), str(valor))
+
+    return huellas
+
+
+def leer_huellas_replica(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLA_HUELLAS} (
+            tabla TEXT,
+            mes TEXT,
+            filas INTEGER,
+            fecha_max TEXT,
+            huella TEXT,
+            columnas TEXT,
+            PRIMARY KEY (tabla, mes)
+        )
+    """)
+
+    previas = {}
+    for tabla, mes, filas, fecha_max, huella, columnas in conn.execute(f"SELECT * FROM {TABLA_HUELLAS}"):
+        previas.setdefault(tabla, {"columnas": columnas, "meses": {}})
+        previas[tabla]["meses"][mes] = (filas, fecha_max, huella)
+
+    return previas
+
+
+def guardar_huellas(conn, tabla, huellas, firma):
+    conn.execute(f"DELETE FROM {TABLA_HUELLAS} WHERE tabla = ?", (tabla,))
+    conn.executemany(
+        f"INSERT INTO {TABLA_HUELLAS} VALUES (?, ?, ?, ?, ?, ?)",
+        [(tabla, mes, *valores, firma) for mes, valores in huellas.items()]
+    )
+
+
+# =====================================================
+# COPIA (por bloques, memoria constante)
+# =====================================================
+# Las filas se leen con cursor del lado del servidor (stream_results) y se
+# escriben con executemany de a FILAS_POR_BLOQUE. Todo el sync es una sola
+# transacción SQLite, con WAL y synchronous=OFF mientras dura la carga.
+
+FILAS_POR_BLOQUE = 10000
+
+# sqlite3 no sabe guardar Decimal y su adaptador de datetime está deprecado
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat(" "))
+sqlite3.register_adapter(datetime.date, lambda d: d.isoformat())
+
+
+def rango_mes(mes):
+    inicio = pd.Timestamp(mes)
+    return inicio, inicio + pd.offsets.MonthBegin(1)
+
+
+def consulta_origen(tabla, columnas, mes=None):
+    """SELECT de `tabla` en Postgres (toda, o las filas de un mes) y sus parámetros."""
+    lista = ", ".join(f'"{c["name"]}"' for c in columnas)
+    consulta = f'SELECT {lista} FROM "{tabla}"'
+
+    if mes is None:
+        return text(consulta), {}
+
+    if mes == SIN_FECHA:
+        return text(consulta + " WHERE fecha IS NULL"), {}
+
+    inicio, fin = rango_mes(mes)
+    consulta = text(consulta + " WHERE fecha >= :inicio AND fecha < :fin").bindparams(
+        bindparam("inicio", type_=DateTime()), bindparam("fin", type_=DateTime())
+    )
+    return consulta, {"inicio": inicio.to_pydatetime(), "fin": fin.to_pydatetime()}
+
+
+def leer_bloques(engine, tabla, columnas, mes=None):
+    """Filas de origen de a FILAS_POR_BLOQUE, con cursor del lado del servidor."""
+    consulta, params = consulta_origen(tabla, columnas, mes)
+
+    with engine.connect() as origen:
+        resultado = origen.execution_options(
+            stream_results=True, yield_per=FILAS_POR_BLOQUE
+        ).execute(consulta, params)
+
+        for bloque in resultado.partitions(FILAS_POR_BLOQUE):
+            yield bloque
+
+
+def borrar_mes_replica(conn, tabla, mes):
+    if mes == SIN_FECHA:
+        conn.execute(f'DELETE FROM "{tabla}" WHERE fecha IS NULL')
+        return
+
+    # en la réplica fecha es texto ISO: se compara como texto (y usa el índice)
+    inicio, fin = rango_mes(mes)
+    conn.execute(
+        f'DELETE FROM "{tabla}" WHERE fecha >= ? AND fecha < ?',
+        (f"{inicio:%Y-%m-%d}", f"{fin:%Y-%m-%d}")
+    )
+
+
+# =====================================================
+# ESQUEMA DE LA RÉPLICA (tipos e índices del origen)
+# =====================================================
+# Las columnas se crean con el tipo reflejado del origen (afinidad SQLite
+# correcta: montos INTEGER, decimales REAL) y las fechas como DATE/DATETIME
+# guardadas en texto ISO, que ordena igual que la fecha y es lo que
+# SQLAlchemy espera en SQLite. Los índices son los mismos del origen
+# (fecha, seccion, item...) con el nombre ix_<tabla>_<columnas> del ETL.
+
+def tipo_replica(tipo):
+    """Tipo declarado en SQLite para un tipo de columna del origen."""
+    if isinstance(tipo, (sqltypes.Integer, sqltypes.Boolean)):
+        return "INTEGER"
+    # desde SQLAlchemy 2.1 Float (double precision) ya no hereda de Numeric
+    if isinstance(tipo, (sqltypes.Float, sqltypes.Numeric)):
+        return "REAL"
+    if isinstance(tipo, sqltypes.DateTime):
+        return "DATETIME"
+    if isinstance(tipo, sqltypes.Date):
+        return "DATE"
+    if isinstance(tipo, sqltypes.NullType):
+        # sin tipo declarado (CREATE TABLE AS en un origen SQLite): afinidad
+        # NUMERIC, que guarda los números como números y el resto como texto
+        return "NUMERIC"
+    return "TEXT"
+
+
+def firma_columnas(columnas):
+    return ",".join(f'{c["name"]} {tipo_replica(c["type"])}' for c in columnas)
+
+
+def indices_origen(inspector, tabla, vistas):
+    """[(columnas, unico)] de los índices de `tabla` en el origen.
+
+    Si `tabla` es la vista de una tabla particionada (SQLite), se toman los
+    índices de sus particiones; en la réplica es una sola tabla.
+    """
+    fuentes = [tabla]
+    if tabla in vistas:
+        fuentes = [t for t in inspector.get_table_names() if es_particion(t, tabla)]
+
+    indices = []
+    for fuente in fuentes:
+        for ix in inspector.get_indexes(fuente):
+            columnas = tuple(ix["column_names"])
+            if not columnas or None in columnas:  # índices sobre expresiones
+                continue
+
+            # un índice único por partición no lo es sobre la tabla completa
+            clave = (columnas, bool(ix.get("unique")) and fuente == tabla)
+            if clave not in indices:
+                indices.append(clave)
+
+    return indices
+
+
+def nombre_indice(tabla, columnas):
+    return f"ix_{tabla}_{'_'.join(columnas)}"
+
+
+def crear_tabla_replica(conn, tabla, columnas):
+    lista = ", ".join(f'"{c["name"]}" {tipo_replica(c["type"])}' for c in columnas)
+    conn.execute(f'DROP TABLE IF EXISTS "{tabla}"')
+    conn.execute(f'CREATE TABLE "{tabla}" ({lista})')
+
+
+def mantener_indices_replica(conn, tabla, indices):
+    for columnas, unico in indices:
+        lista = ", ".join(f'"{c}"' for c in columnas)
+        conn.execute(
+            f'CREATE {"UNIQUE " if unico else ""}INDEX IF NOT EXISTS '
+            f'"{nombre_indice(tabla, columnas)}" ON "{tabla}" ({lista})'
+        )
+
+
+def tablas_en_replica(conn):
+    return {t for (t,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def staging(tabla):
+    return f"stg_{tabla}"
+
+
+# =====================================================
+# SYNC EN PARALELO (lectores en hilos, un solo escritor)
+# =====================================================
+# Casi todo el tiempo de cada tabla es esperar a Postgres (Neon). Cada tabla
+# se lee en un hilo de un pool chico, con su propia conexión del pool del
+# engine; los bloques llegan por una cola acotada al hilo principal, el único
+# que escribe en SQLite. Como los bloques de distintas tablas se intercalan,
+# cada tabla se carga en stg_<tabla> y se aplica de una vez cuando su lector
+# termina (o se descarta si la lectura falló).
+
+SYNC_HILOS = int(os.environ.get("SYNC_HILOS", "4"))
+BLOQUES_EN_COLA = 8
+
+
+def planear_tabla(engine, tabla, previa, existe, vistas):
+    """Qué hay que copiar de `tabla`. Solo consulta el origen."""
+    inspector = inspect(engine)
+    columnas = inspector.get_columns(tabla)
+    firma = firma_columnas(columnas)
+    huellas = huellas_origen(engine, tabla, columnas)
+
+    plan = {
+        "tabla": tabla,
+        "columnas": columnas,
+        "firma": firma,
+        "huellas": huellas,
+        "indices": indices_origen(inspector, tabla, vistas),
+        "cambiados": [],
+        "borrados": [],
+    }
+
+    if existe and previa is not None and previa["columnas"] == firma and previa["meses"] == huellas:
+        plan["modo"] = "sin cambios"
+
+    elif (
+        not existe
+        or previa is None
+        or previa["columnas"] != firma
+        or TABLA_COMPLETA in huellas
+        or TABLA_COMPLETA in previa["meses"]
+    ):
+        plan["modo"] = "completa"
+
+    else:
+        meses_previos = previa["meses"]
+        plan["modo"] = "meses"
+        plan["cambiados"] = sorted(m for m in huellas if huellas[m] != meses_previos.get(m))
+        plan["borrados"] = sorted(m for m in meses_previos if m not in huellas)
+
+    return plan
+
+
+def leer_tabla(engine, tabla, previa, existe, vistas, cola, descartadas):
+    """Lector (hilo del pool): manda a la cola el plan, los bloques y el cierre."""
+    try:
+        plan = planear_tabla(engine, tabla, previa, existe, vistas)
+        cola.put(("inicio", tabla, plan))
+
+        meses = {"sin cambios": [], "completa": [None], "meses": plan["cambiados"]}[plan["modo"]]
+        for mes in meses:
+            with closing(leer_bloques(engine, tabla, plan["columnas"], mes)) as bloques:
+                for bloque in bloques:
+                    # el escritor ya la descartó (o abortó el sync): no seguir leyendo
+                    if tabla in descartadas:
+                        raise RuntimeError("copia descartada")
+                    cola.put(("filas", tabla, bloque))
+
+        cola.put(("fin", tabla, None))
+
+    except Exception as e:
+        cola.put(("error", tabla, e))
+
+
+def aplicar_tabla(conn, plan, filas):
+    """Pasa stg_<tabla> a la réplica y guarda las huellas. Devuelve qué se hizo."""
+    tabla = plan["tabla"]
+
+    if plan["modo"] == "sin cambios":
+        mantener_indices_replica(conn, tabla, plan["indices"])
+        return "sin cambios"
+
+    if plan["modo"] == "completa":
+        conn.execute(f'DROP TABLE IF EXISTS "{tabla}"')
+        conn.execute(f'ALTER TABLE "{staging(tabla)}" RENAME TO "{tabla}"')
+        # índices después de la carga: más rápido que mantenerlos fila a fila
+        mantener_indices_replica(conn, tabla, plan["indices"])
+        resultado = f"completa ({filas} filas)"
+
+    else:
+        mantener_indices_replica(conn, tabla, plan["indices"])
+        for mes in plan["borrados"] + plan["cambiados"]:
+            borrar_mes_replica(conn, tabla, mes)
+
+        conn.execute(f'INSERT INTO "{tabla}" SELECT * FROM "{staging(tabla)}"')
+        conn.execute(f'DROP TABLE "{staging(tabla)}"')
+        resultado = (
+            f"{len(plan['cambiados'])} meses nuevos/cambiados, "
+            f"{len(plan['borrados'])} borrados ({filas} filas)"
+        )
+
+    conn.execute(f'ANALYZE "{tabla}"')
+    guardar_huellas(conn, tabla, plan["huellas"], plan["firma"])
+    return resultado
+
+
+def escribir_mensaje(conn, tipo, tabla, dato, planes, filas):
+    if tipo == "inicio":
+        planes[tabla] = dato
+        filas[tabla] = 0
+        if dato["modo"] != "sin cambios":
+            crear_tabla_replica(conn, staging(tabla), dato["columnas"])
+
+    elif tipo == "filas":
+        marcas = ", ".join("?" for _ in planes[tabla]["columnas"])
+        conn.executemany(f'INSERT INTO "{staging(tabla)}" VALUES ({marcas})', dato)
+        filas[tabla] += len(dato)
+
+    elif tipo == "fin":
+        conn.execute("SAVEPOINT tabla")
+        try:
+            resultado = aplicar_tabla(conn, planes[tabla], filas[tabla])
+        except Exception:
+            conn.execute("ROLLBACK TO tabla")
+            conn.execute("RELEASE tabla")
+            raise
+        conn.execute("RELEASE tabla")
+        print(f"-> {tabla}: {resultado}")
+
+    else:
+        raise dato
+
+
+def escribir_replica(conn, cola, tablas, descartadas):
+    """Escritor (hilo principal): aplica lo que mandan los lectores hasta que terminen todos."""
+    planes, filas = {}, {}
+    pendientes = len(tablas)
+
+    try:
+        while pendientes:
+            tipo, tabla, dato = cola.get()
+            if tipo in ("fin", "error"):
+                pendientes -= 1
+
+            if tabla in descartadas:
+                continue
+
+            try:
+                escribir_mensaje(conn, tipo, tabla, dato, planes, filas)
+            except Exception as e:
+                # falla solo esta tabla: la réplica se queda con su versión anterior
+                descartadas.add(tabla)
+                conn.execute(f'DROP TABLE IF EXISTS "{staging(tabla)}"')
+                print(f"⚠️ Error exportando {tabla}: {e}")
+
+    except BaseException:
+        # cortar a los lectores y vaciar la cola para que el pool pueda cerrar
+        descartadas.update(tablas)
+        while pendientes:
+            tipo, _, _ = cola.get()
+            if tipo in ("fin", "error"):
+                pendientes -= 1
+        raise
+
+
+def abrir_replica(sqlite_path):
+    """Conexión SQLite en modo manual de transacciones, lista para carga bulk."""
+    conn = sqlite3.connect(sqlite_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    return conn
+
+
+def ruta_replica():
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(project_root, "database", "kairos.db")
+
+
+def main(database_url=None, sqlite_path=None, hilos=None):
+    database_url = database_url or os.environ.get("DATABASE_URL")
     if not database_url:
         raise RuntimeError("Falta DATABASE_URL en variables de entorno.")
 
     # Paths
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    sqlite_path = os.path.join(project_root, "database", "kairos.db")
+    sqlite_path = sqlite_path or ruta_replica()
     os.makedirs(os.path.dirname(sqlite_path), exist_ok=True)
 
     print("Conectando a Postgres...")
-    engine = create_engine(database_url)
+    engine = crear_engine_origen(database_url)
 
     # Detectar automáticamente todas las tablas
     inspector = inspect(engine)
-    tables = inspector.get_table_names()
+    tables = listar_tablas(inspector)
+    vistas = set(inspector.get_view_names())
 
     if not tables:
         print("⚠️ No se encontraron tablas en Postgres.")
@@ -29,20 +481,36 @@ def main():
 
     # Conectar SQLite
     print(f"Creando/Actualizando SQLite en: {sqlite_path}")
-    conn = sqlite3.connect(sqlite_path)
+    conn = abrir_replica(sqlite_path)
 
-    for t in tables:
-        try:
-            print(f"-> Exportando {t} ...")
-            df = pd.read_sql(f'SELECT * FROM "{t}"', engine)
-            df.to_sql(t, conn, if_exists="replace", index=False)
-        except Exception as e:
-            print(f"⚠️ Error exportando {t}: {e}")
+    cola = queue.Queue(maxsize=BLOQUES_EN_COLA)
+    descartadas = set()
+
+    try:
+        conn.execute("BEGIN")
+        previas = leer_huellas_replica(conn)
+        existentes = tablas_en_replica(conn)
+
+        with ThreadPoolExecutor(max_workers=hilos or SYNC_HILOS) as pool:
+            for t in tables:
+                pool.submit(leer_tabla, engine, t, previas.get(t), t in existentes, vistas, cola, descartadas)
+
+            escribir_replica(conn, cola, tables, descartadas)
+
+        conn.execute("COMMIT")
+
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+    finally:
+        conn.close()
+        engine.dispose()
 
-    conn.close()
     print("✅ Sync terminado correctamente.")
     print("Abre database/kairos.db en VS Code para revisar.")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()